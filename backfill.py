@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+""" A script that backfills trades and candles from the GDAX REST API into
+tickers.db, for the time the logger was not running.
+"""
+from gdax_logger.Backfill import Backfill
+from gdax_logger.Timestamps import parse_time
+from gdax_logger.EventLog import EventLog
+from gdax_logger import GDAXConst
+from datetime import datetime
+import argparse
+
+PRODUCT_IDS = [
+    GDAXConst.btc_usd,
+    GDAXConst.eth_usd,
+    GDAXConst.ltc_usd,
+    GDAXConst.bch_usd
+]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--start', required=True, type=parse_time,
+        help='UTC start of the range, e.g. 2018-01-01T00:00:00')
+    parser.add_argument(
+        '--end', type=parse_time, default=datetime.utcnow(),
+        help='UTC end of the range (default: now)')
+    parser.add_argument(
+        '--products', nargs='+', default=PRODUCT_IDS, metavar='PRODUCT',
+        help='products to backfill (default: %(default)s)')
+    parser.add_argument(
+        '--no-trades', action='store_true',
+        help='do not backfill trades into the tickers table')
+    parser.add_argument(
+        '--no-candles', action='store_true',
+        help='do not backfill candles into the candles table')
+    parser.add_argument(
+        '--granularity', type=int, default=60,
+        choices=[60, 300, 900, 3600, 21600, 86400],
+        help='candle length in seconds (default: %(default)s)')
+    parser.add_argument(
+        '--workers', type=int, default=4,
+        help='most concurrent requests (default: %(default)s)')
+    parser.add_argument(
+        '--rate-limit', type=float, default=3,
+        help='most requests per second (default: %(default)s)')
+    parser.add_argument(
+        '--rest-url', default=GDAXConst.Live.rest_url,
+        help='REST api url, can point at a local stand-in server '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--checkpoint', default='backfill.json',
+        help='checkpoint file used to resume (default: %(default)s)')
+    args = parser.parse_args()
+
+    event_log = EventLog.get_logger(__name__, 'main.log')
+    event_log.debug('backfill started')
+
+    with Backfill(rest_url=args.rest_url,
+                  checkpoint_path=args.checkpoint,
+                  workers=args.workers,
+                  rate_limit=args.rate_limit,
+                  granularity=args.granularity) as backfill:
+        counts = backfill.run(args.products, args.start, args.end,
+                              trades=not args.no_trades,
+                              candles=not args.no_candles)
+    print('backfilled {} trades and {} candles'.format(
+        counts[GDAXConst.trades], counts[GDAXConst.candles]))
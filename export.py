@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+""" A script that exports logged order books or tickers to sharded CSV or
+Parquet files, streaming rows so memory stays bounded.
+"""
+from gdax_logger.Exporter import Exporter, FORMATS
+from gdax_logger.Timestamps import parse_time, to_epoch
+import argparse
+import sys
+
+
+def report(rows, elapsed):
+    """ Prints the rows exported so far and the export rate."""
+    sys.stderr.write('\r{} rows, {:.0f} rows/s'.format(
+        rows, rows / max(elapsed, 1e-9)))
+    sys.stderr.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--db', default='order_books.db',
+        help='database to export from (default: %(default)s)')
+    parser.add_argument(
+        '--table', default='order_books',
+        help='table to export, order_books or tickers '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--start', type=parse_time,
+        help='UTC start of the range (default: the oldest row)')
+    parser.add_argument(
+        '--end', type=parse_time,
+        help='UTC end of the range (default: the newest row)')
+    parser.add_argument(
+        '--products', nargs='+', metavar='PRODUCT',
+        help='only export these products (default: all)')
+    parser.add_argument(
+        '--format', default='csv', choices=FORMATS,
+        help='output format, parquet needs pyarrow (default: %(default)s)')
+    parser.add_argument(
+        '--out', default='export',
+        help='directory the shards are written to, must be empty '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--overwrite', action='store_true',
+        help='delete the shards of an earlier export from --out first')
+    parser.add_argument(
+        '--workers', type=int,
+        help='worker processes (default: one per core)')
+    parser.add_argument(
+        '--shards', type=int,
+        help='number of output files (default: 4 per worker)')
+    parser.add_argument(
+        '--chunk-size', type=int, default=50000,
+        help='rows read at a time per worker (default: %(default)s)')
+    args = parser.parse_args()
+
+    try:
+        exporter = Exporter(args.db, table=args.table, out_dir=args.out,
+                            file_format=args.format, workers=args.workers,
+                            chunk_size=args.chunk_size, shards=args.shards,
+                            overwrite=args.overwrite)
+        rows = exporter.run(
+            start=None if args.start is None else to_epoch(args.start),
+            end=None if args.end is None else to_epoch(args.end),
+            product_ids=args.products,
+            on_progress=report)
+    except ValueError as error:
+        parser.error(str(error))
+    sys.stderr.write('\n')
+    print('exported {} rows to {}'.format(rows, args.out))
@@ -0,0 +1,334 @@
+from .GDAXConstants import GDAXConst
+from .RestClient import RestClient
+from .Database import Database
+from .EventLog import EventLog
+from .Timestamps import parse_time, to_epoch
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+from typing import List
+import threading
+import sqlite3
+import json
+import logging
+import os
+
+
+class Backfill(object):
+    """Fills gaps in `tickers.db` left while the logger was down, from the
+    GDAX REST API.
+
+    Trades are written to the `tickers` table, one row per trade (fields
+    a trade does not carry, such as best bid and ask, are left NULL). The
+    ids of the first and last trade of the range are found by binary
+    search on the `after` cursor of the `trades` endpoint, and the span of
+    ids between them is split into chunks aligned on multiples of
+    `chunk_trades`, each paged backwards as a separate task. Candles are
+    fetched in windows of 300 candles and written to the `candles` table,
+    each window a separate task. Tasks run concurrently on a bounded
+    thread pool that shares one pooled, rate limited `RestClient`.
+
+    Progress is saved to a JSON checkpoint file after every page and
+    window, keyed by trade ids rather than by time, so that an interrupted
+    backfill resumes where it stopped even when its end is 'now'. Rows are
+    inserted with INSERT OR IGNORE, so replaying a page is harmless.
+
+    Attributes:
+        rest_url -- A string. The base url of the REST API, can point at a
+                    local stand-in server.
+        ticker_path -- A string. The database trades and candles go to.
+        checkpoint_path -- A string. The checkpoint file.
+        workers -- An int. The most concurrent requests.
+        granularity -- An int. The candle length in seconds.
+        chunk_trades -- An int. The number of trade ids per trades task.
+
+    Methods:
+        run() -- Backfill a time range for a list of products.
+    """
+
+    # Static Variable
+    __event_log = logging.getLogger(__name__)
+    __TRADE_SQL = ('INSERT OR IGNORE INTO tickers (system_time, server_time, '
+                   'product_id, price, side, last_size) '
+                   'VALUES (?, ?, ?, ?, ?, ?)')
+    __CANDLE_SQL = ('INSERT OR IGNORE INTO candles '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
+    __CANDLES_PER_REQUEST = 300
+    __DB_TIMEOUT = 5.0
+
+    def __init__(self,
+                 rest_url: str = GDAXConst.Live.rest_url,
+                 ticker_path: str = 'tickers.db',
+                 checkpoint_path: str = 'backfill.json',
+                 workers: int = 4,
+                 rate_limit: float = 3,
+                 granularity: int = 60,
+                 chunk_trades: int = 10000):
+        EventLog.get_logger(__name__, 'Backfill.log')
+        self.rest_url = rest_url
+        self.ticker_path = ticker_path
+        self.checkpoint_path = checkpoint_path
+        self.workers = workers
+        self.granularity = granularity
+        self.chunk_trades = chunk_trades
+        self.__client = RestClient(rest_url, pool_size=workers,
+                                   rate_limit=rate_limit)
+        self.__write_lock = threading.Lock()
+        self.__checkpoint_lock = threading.Lock()
+        self.__checkpoints = self.__load_checkpoints()
+
+        Database.write(self.ticker_path, Database.TICKERS_TABLE,
+                       timeout=self.__DB_TIMEOUT)
+        Database.write(self.ticker_path, Database.CANDLES_TABLE,
+                       timeout=self.__DB_TIMEOUT)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.__client.close()
+
+    def run(self, product_ids: List[str], start: datetime, end: datetime,
+            trades: bool = True, candles: bool = True) -> dict:
+        """Backfill the trades and candles of every product from the
+        start up to, not including, the end, and return the number of rows
+        fetched per task kind. Tasks that fail are logged and retried on
+        the next run.
+
+        Arguments:
+            product_ids -- A list of strings. The products to backfill.
+            start -- A datetime. The naive UTC start of the range.
+            end -- A datetime. The naive UTC end of the range.
+            trades -- A bool. Whether to backfill trades.
+            candles -- A bool. Whether to backfill candles.
+        """
+        counts = {GDAXConst.trades: 0, GDAXConst.candles: 0}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # Planning a product's trades yields its chunks, which are
+            # then submitted as trades tasks of their own.
+            futures = {}
+            for product_id in product_ids:
+                if trades:
+                    future = executor.submit(self.__trade_chunks,
+                                             product_id, start, end)
+                    futures[future] = (None, product_id)
+                if candles:
+                    for window in self.__candle_windows(start, end):
+                        future = executor.submit(self.__backfill_candles,
+                                                 product_id, *window)
+                        futures[future] = (GDAXConst.candles, product_id)
+
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, product_id = futures.pop(future)
+                    try:
+                        result = future.result()
+                    except (sqlite3.Error, OSError, ValueError) as error:
+                        self.__event_log.error(
+                            '%s backfill of %s failed: %s',
+                            kind or GDAXConst.trades, product_id, error)
+                        continue
+                    if kind is not None:
+                        counts[kind] += result
+                        continue
+                    for chunk in result:
+                        chunk_future = executor.submit(
+                            self.__backfill_trades, product_id, *chunk)
+                        futures[chunk_future] = (GDAXConst.trades,
+                                                 product_id)
+
+        self.__event_log.info('backfilled %s trades and %s candles',
+                              counts[GDAXConst.trades],
+                              counts[GDAXConst.candles])
+        return counts
+
+    def __trade_chunks(self, product_id: str, start: datetime,
+                       end: datetime) -> list:
+        """Return the [first, last] trade id chunks of a product's trades
+        at or after the start and before the end, aligned on multiples of
+        `chunk_trades` so that a later run with a later end shares every
+        chunk but the last.
+        """
+        page, _ = self.__client.get_trades(product_id, limit=1)
+        if page is None:
+            raise ValueError('trades request for {} failed'.format(
+                product_id))
+        if not page:
+            return []
+        newest_id = page[0][GDAXConst.trade_id]
+        newest_time = parse_time(page[0][GDAXConst.time])
+
+        first_id = self.__first_trade_id(product_id, start, newest_id,
+                                         newest_time)
+        last_id = self.__first_trade_id(product_id, end, newest_id,
+                                        newest_time) - 1
+        if first_id > last_id:
+            return []
+
+        chunks = []
+        for chunk in range(first_id // self.chunk_trades,
+                           last_id // self.chunk_trades + 1):
+            chunks.append((max(first_id, chunk * self.chunk_trades),
+                           min(last_id, (chunk + 1) * self.chunk_trades - 1)))
+        self.__event_log.info('%s: trades %s to %s in %s chunks', product_id,
+                              first_id, last_id, len(chunks))
+        return chunks
+
+    def __first_trade_id(self, product_id: str, moment: datetime,
+                         newest_id: int, newest_time: datetime) -> int:
+        """Return the id of the first trade at or after a time, or
+        newest_id + 1 if there is none, by binary search on the trade ids.
+        Trade ids grow with time, so each probe only needs the one trade
+        just before a cursor. Results for times up to the newest trade
+        cannot change, and are checkpointed.
+        """
+        if moment > newest_time:
+            return newest_id + 1
+        key = '{}/{}/{}'.format(GDAXConst.trade_id, product_id,
+                                moment.isoformat())
+        trade_id = self.__get_checkpoint(key, None)
+        if trade_id is not None:
+            return trade_id
+
+        low, high = 1, newest_id
+        while low < high:
+            middle = (low + high) // 2
+            page, _ = self.__client.get_trades(product_id, str(middle + 1),
+                                               limit=1)
+            if page is None:
+                raise ValueError('trades request failed after cursor '
+                                 '{}'.format(middle + 1))
+            if not page:
+                low = middle + 1
+                continue
+            trade_time = parse_time(page[0][GDAXConst.time])
+            if trade_time >= moment:
+                high = middle
+            else:
+                low = middle + 1
+
+        self.__set_checkpoint(key, low)
+        return low
+
+    def __backfill_trades(self, product_id: str, first_id: int,
+                          last_id: int) -> int:
+        """Page backwards through a product's trades with ids within
+        [first id, last id], from the checkpoint cursor or the last id.
+        """
+        key = '{}/{}/{}/{}'.format(GDAXConst.trades, product_id, first_id,
+                                   last_id)
+        checkpoint = self.__get_checkpoint(key, {'after': str(last_id + 1),
+                                                 'done': False})
+        if checkpoint['done']:
+            return 0
+
+        after = checkpoint['after']
+        count = 0
+        while True:
+            page, cursor = self.__client.get_trades(product_id, after)
+            if page is None:
+                raise ValueError('trades request failed after cursor '
+                                 '{}'.format(after))
+
+            rows = []
+            reached_first = cursor is None
+            for trade in page:
+                if trade[GDAXConst.trade_id] < first_id:
+                    reached_first = True
+                    break
+                rows.append(self.__trade_row(
+                    product_id, trade, parse_time(trade[GDAXConst.time])))
+            self.__write(self.__TRADE_SQL, rows)
+            count += len(rows)
+
+            after = cursor
+            reached_first = reached_first or int(after) <= first_id
+            self.__set_checkpoint(key, {'after': after,
+                                        'done': reached_first})
+            if reached_first:
+                self.__event_log.debug('%s: %s trades backfilled from %s '
+                                       'to %s', product_id, count, first_id,
+                                       last_id)
+                return count
+
+    def __backfill_candles(self, product_id: str, start: datetime,
+                           end: datetime) -> int:
+        """Fetch and write the candles of one window of a product."""
+        key = '{}/{}/{}/{}/{}'.format(GDAXConst.candles, product_id,
+                                      self.granularity, start.isoformat(),
+                                      end.isoformat())
+        if self.__get_checkpoint(key, False):
+            return 0
+
+        candles = self.__client.get_candles(product_id, start.isoformat(),
+                                            end.isoformat(),
+                                            self.granularity)
+        if candles is None:
+            raise ValueError('candles request for {} failed'.format(
+                start.isoformat()))
+
+        rows = [[product_id, self.granularity] + candle[:6]
+                for candle in candles]
+        self.__write(self.__CANDLE_SQL, rows)
+        self.__set_checkpoint(key, True)
+        return len(rows)
+
+    def __candle_windows(self, start: datetime, end: datetime) -> list:
+        """Split a range into windows of at most 300 candles."""
+        span = timedelta(seconds=self.granularity *
+                         self.__CANDLES_PER_REQUEST)
+        windows = []
+        while start < end:
+            windows.append((start, min(start + span, end)))
+            start += span
+        return windows
+
+    @staticmethod
+    def __trade_row(product_id: str, trade: dict,
+                    trade_time: datetime) -> list:
+        """Return the `tickers` row of a trade. The side of a trade is the
+        maker's side, a ticker's side is the taker's, so it is inverted.
+
+        system_time is the primary key of the table and one taker order
+        often fills several trades within the same millisecond, so the
+        trade id is folded into the microseconds to keep them apart.
+        """
+        side = (GDAXConst.sell if trade[GDAXConst.side] == GDAXConst.buy
+                else GDAXConst.buy)
+        system_time = (to_epoch(trade_time.replace(
+            microsecond=trade_time.microsecond // 1000 * 1000)) +
+            trade[GDAXConst.trade_id] % 1000 * 1e-6)
+        return [system_time, trade[GDAXConst.time], product_id,
+                float(trade[GDAXConst.price]), side,
+                float(trade[GDAXConst.size])]
+
+    def __write(self, sql: str, rows: list):
+        """Write rows in one transaction. SQLite takes a single writer, so
+        writes from every worker are serialized."""
+        if not rows:
+            return
+        with self.__write_lock:
+            Database.write(self.ticker_path, sql, rows, self.__DB_TIMEOUT)
+
+    def __load_checkpoints(self) -> dict:
+        if not os.path.exists(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path) as checkpoint_file:
+            return json.load(checkpoint_file)
+
+    def __get_checkpoint(self, key: str, default):
+        with self.__checkpoint_lock:
+            return self.__checkpoints.get(key, default)
+
+    def __set_checkpoint(self, key: str, value):
+        """Save a checkpoint, replacing the file atomically so that an
+        interrupted write never loses earlier progress."""
+        with self.__checkpoint_lock:
+            self.__checkpoints[key] = value
+            temp_path = self.checkpoint_path + '.tmp'
+            with open(temp_path, 'w') as checkpoint_file:
+                json.dump(self.__checkpoints, checkpoint_file, indent=1)
+            os.replace(temp_path, self.checkpoint_path)
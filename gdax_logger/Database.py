@@ -0,0 +1,41 @@
+from typing import Iterable
+import sqlite3
+
+
+class Database(object):
+    """
+        SQLite schemas and the batched writer shared by the live logger
+        and the historical backfill.
+    """
+    TICKERS_TABLE = """CREATE TABLE IF NOT EXISTS tickers
+            (system_time real PRIMARY KEY, server_time text, product_id text,
+            price real, open_24h real, volume_24h real, best_bid real,
+            best_ask real, side text, last_size real);"""
+
+    CANDLES_TABLE = """CREATE TABLE IF NOT EXISTS candles
+            (product_id text, granularity integer, time real, low real,
+            high real, open real, close real, volume real,
+            PRIMARY KEY (product_id, granularity, time));"""
+
+    @staticmethod
+    def write(path: str, sql: str, rows: Iterable = None,
+              timeout: float = 0.15):
+        """Execute a statement in a single transaction, once for every row
+        of `rows`, or once without parameters if no rows are given. Raises
+        sqlite3.Error if the transaction fails, nothing is written then.
+
+        Arguments:
+            path -- A string. The path of the database file.
+            sql -- A string. The statement to execute.
+            rows -- An iterable of sequences. The parameters of each row.
+            timeout -- A number. How long to wait for a lock, in seconds.
+        """
+        connection = sqlite3.connect(path, timeout=timeout)
+        try:
+            with connection:
+                if rows is None:
+                    connection.execute(sql)
+                else:
+                    connection.executemany(sql, rows)
+        finally:
+            connection.close()
@@ -0,0 +1,336 @@
+from .GDAXConstants import GDAXConst
+from .EventLog import EventLog
+from collections import deque
+from typing import List
+import ipaddress
+import selectors
+import threading
+import socket
+import struct
+import logging
+import os
+
+
+# Every frame starts with a fixed header: frame type, number of float64
+# values that follow, product id (ascii, null padded) and system time.
+# Longer product ids are not published.
+PRODUCT_ID_SIZE = 16
+FRAME_HEADER = struct.Struct('<BH{}sd'.format(PRODUCT_ID_SIZE))
+DEPTH_FRAME = 1
+TICKER_FRAME = 2
+
+# The float64 values of a ticker frame, in order. Side is +1 for buy,
+# -1 for sell and NaN if missing.
+TICKER_FIELDS = [GDAXConst.price, GDAXConst.open_24h, GDAXConst.volume_24h,
+                 GDAXConst.best_bid, GDAXConst.best_ask, GDAXConst.last_size,
+                 GDAXConst.side]
+
+
+def read_frames(sock: socket.socket):
+    """Yield (frame type, product id, system time, values) tuples for every
+    frame received on a subscriber socket, until it is closed.
+
+    Arguments:
+        sock -- A socket. A connected, subscribed socket.
+    """
+    buffer = b''
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return
+        buffer += chunk
+        while len(buffer) >= FRAME_HEADER.size:
+            frame_type, count, product_id, system_time = \
+                FRAME_HEADER.unpack_from(buffer)
+            frame_size = FRAME_HEADER.size + 8 * count
+            if len(buffer) < frame_size:
+                break
+            values = struct.unpack_from('<{}d'.format(count), buffer,
+                                        FRAME_HEADER.size)
+            buffer = buffer[frame_size:]
+            yield (frame_type, product_id.rstrip(b'\0').decode(),
+                   system_time, values)
+
+
+class Subscriber(object):
+    """A connected client, the products it subscribed to and the frames
+    waiting to be sent to it."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.products = set()
+        self.frames = deque()
+        self.buffered = 0
+        self.sent = 0
+        self.dropped = 0
+        self.request = b''
+
+
+class DepthPublisher(object):
+    """Publishes sampled depth rows and tickers to local subscribers over
+    a Unix domain socket or a TCP socket on localhost.
+
+    Subscribers send newline terminated product ids ('BTC-USD\\n') to
+    subscribe to a product, or '*' to subscribe to every product, and
+    receive struct packed frames (see FRAME_HEADER). Frames are queued per
+    subscriber and written by a background thread, so publishing never
+    blocks. Once a subscriber has `max_buffer` bytes queued its oldest
+    frames are dropped, so a slow subscriber can never hold up ingestion.
+
+    Attributes:
+        address -- A string. A socket path, or 'host:port' for TCP, where
+                   host must be a loopback address such as localhost.
+        max_buffer -- An int. The most bytes queued per subscriber.
+
+    Methods:
+        start() -- Start accepting subscribers.
+        publish_depth() -- Publish a depth row from OrderBook.query().
+        publish_ticker() -- Publish a ticker message.
+        close() -- Disconnect every subscriber and stop.
+    """
+
+    # Static Variable
+    __event_log = logging.getLogger(__name__)
+
+    def __init__(self, address: str, max_buffer: int = 1 << 20):
+        EventLog.get_logger(__name__, 'DepthPublisher.log')
+        self.address = address
+        self.max_buffer = max_buffer
+        self.__closed = False
+        self.__lock = threading.Lock()
+        self.__subscribers = {}
+        self.__server = self.__listen(address)
+        self.__selector = selectors.DefaultSelector()
+        self.__wake_reader, self.__wake_writer = socket.socketpair()
+        self.__wake_reader.setblocking(False)
+        self.__wake_writer.setblocking(False)
+        self.__thread = threading.Thread(target=self.__serve, name='publisher',
+                                        daemon=True)
+
+    def start(self):
+        self.__thread.start()
+        self.__event_log.info('publishing on %s', self.address)
+
+    def publish_depth(self, row: List):
+        """Publish a depth row as returned by OrderBook.query(), i.e.
+        [system_time, product_id, server_time, price, volumes...].
+
+        Arguments:
+            row -- A list. The depth row.
+        """
+        self.__publish(DEPTH_FRAME, row[1], row[0], row[3:])
+
+    def publish_ticker(self, ticker: dict):
+        """Publish a ticker. GDAX sends numbers as strings, they are
+        converted here. Missing fields are sent as NaN.
+
+        Arguments:
+            ticker -- A dictionary. The ticker message, with system_time.
+        """
+        values = []
+        for field in TICKER_FIELDS:
+            value = ticker.get(field)
+            if field == GDAXConst.side and value is not None:
+                value = 1 if value == GDAXConst.buy else -1
+            values.append(float('nan') if value is None else float(value))
+        self.__publish(TICKER_FRAME, ticker.get(GDAXConst.product_id, ''),
+                       ticker[GDAXConst.system_time], values)
+
+    def close(self):
+        self.__closed = True
+        self.__wake()
+        if self.__thread.is_alive():
+            self.__thread.join()
+        for subscriber in list(self.__subscribers.values()):
+            subscriber.sock.close()
+        self.__server.close()
+        self.__wake_reader.close()
+        self.__wake_writer.close()
+        if not self.__is_tcp(self.address) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def __publish(self, frame_type: int, product_id: str,
+                  system_time: float, values: List[float]):
+        """Pack a frame once and queue it for every subscriber of the
+        product, dropping the oldest unsent frames of full subscribers.
+        """
+        encoded_id = product_id.encode()
+        if len(encoded_id) > PRODUCT_ID_SIZE:
+            self.__event_log.warning('product id %s is too long to publish',
+                                     product_id,
+                                     extra={'rate_key': ('long_id',
+                                                         product_id)})
+            return
+        frame = (FRAME_HEADER.pack(frame_type, len(values),
+                                   encoded_id, system_time) +
+                 struct.pack('<{}d'.format(len(values)), *values))
+
+        with self.__lock:
+            for subscriber in self.__subscribers.values():
+                if (product_id not in subscriber.products and
+                        '*' not in subscriber.products):
+                    continue
+
+                while (subscriber.frames and
+                       subscriber.buffered + len(frame) > self.max_buffer):
+                    # A partly sent head frame has to be finished first.
+                    if not subscriber.sent:
+                        dropped = subscriber.frames.popleft()
+                    elif len(subscriber.frames) > 1:
+                        dropped = subscriber.frames[1]
+                        del subscriber.frames[1]
+                    else:
+                        break
+                    subscriber.buffered -= len(dropped)
+                    subscriber.dropped += 1
+                subscriber.frames.append(frame)
+                subscriber.buffered += len(frame)
+        self.__wake()
+
+    def __wake(self):
+        """Wake the background thread so that it picks up new frames."""
+        try:
+            self.__wake_writer.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def __listen(self, address: str) -> socket.socket:
+        if self.__is_tcp(address):
+            host, port = address.rsplit(':', 1)
+            if not self.__is_loopback(host):
+                raise ValueError('refusing to publish on {}, only loopback '
+                                 'addresses are allowed'.format(address))
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((host, int(port)))
+        else:
+            if os.path.exists(address):
+                os.unlink(address)
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(address)
+        server.listen()
+        server.setblocking(False)
+        return server
+
+    @staticmethod
+    def __is_tcp(address: str) -> bool:
+        return ':' in address and not address.startswith(('/', '.'))
+
+    @staticmethod
+    def __is_loopback(host: str) -> bool:
+        """Return whether every address a host name resolves to is a
+        loopback address."""
+        if not host:
+            return False
+        try:
+            addresses = socket.getaddrinfo(host, None, socket.AF_INET,
+                                           socket.SOCK_STREAM)
+        except socket.gaierror:
+            return False
+        return all(ipaddress.ip_address(sockaddr[0]).is_loopback
+                   for *_, sockaddr in addresses)
+
+    def __serve(self):
+        """Accept subscribers, read their subscriptions and write their
+        queued frames until closed."""
+        self.__selector.register(self.__server, selectors.EVENT_READ)
+        self.__selector.register(self.__wake_reader, selectors.EVENT_READ)
+        while not self.__closed:
+            for key, events in self.__selector.select(timeout=1):
+                if key.fileobj is self.__server:
+                    self.__accept()
+                elif key.fileobj is self.__wake_reader:
+                    try:
+                        self.__wake_reader.recv(4096)
+                    except BlockingIOError:
+                        pass
+                else:
+                    subscriber = key.data
+                    if events & selectors.EVENT_READ:
+                        self.__read(subscriber)
+                    if (events & selectors.EVENT_WRITE and
+                            subscriber.sock.fileno() != -1):
+                        self.__write(subscriber)
+            self.__update_interest()
+        self.__selector.close()
+
+    def __accept(self):
+        try:
+            sock, _ = self.__server.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        subscriber = Subscriber(sock)
+        with self.__lock:
+            self.__subscribers[sock.fileno()] = subscriber
+        self.__selector.register(sock, selectors.EVENT_READ, subscriber)
+        self.__event_log.info('subscriber %s connected', sock.fileno())
+
+    def __read(self, subscriber: Subscriber):
+        """Read subscription requests, one product id per line."""
+        try:
+            data = subscriber.sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.__disconnect(subscriber)
+            return
+
+        subscriber.request += data
+        *lines, subscriber.request = subscriber.request.split(b'\n')
+        with self.__lock:
+            for line in lines:
+                product_id = line.strip().decode(errors='ignore')
+                if product_id:
+                    subscriber.products.add(product_id)
+
+    def __write(self, subscriber: Subscriber):
+        """Send as much of the subscriber's queued frames as the socket
+        accepts without blocking."""
+        with self.__lock:
+            while subscriber.frames:
+                frame = subscriber.frames[0]
+                try:
+                    sent = subscriber.sock.send(
+                        memoryview(frame)[subscriber.sent:])
+                except (BlockingIOError, InterruptedError):
+                    return
+                except OSError:
+                    break
+                subscriber.sent += sent
+                if subscriber.sent < len(frame):
+                    return
+                subscriber.frames.popleft()
+                subscriber.buffered -= len(frame)
+                subscriber.sent = 0
+            else:
+                return
+        self.__disconnect(subscriber)
+
+    def __update_interest(self):
+        """Watch subscribers with queued frames for writability."""
+        with self.__lock:
+            subscribers = list(self.__subscribers.values())
+        for subscriber in subscribers:
+            events = selectors.EVENT_READ
+            if subscriber.frames:
+                events |= selectors.EVENT_WRITE
+            try:
+                key = self.__selector.get_key(subscriber.sock)
+            except (KeyError, ValueError):
+                continue
+            if key.events != events:
+                self.__selector.modify(subscriber.sock, events, subscriber)
+
+    def __disconnect(self, subscriber: Subscriber):
+        with self.__lock:
+            self.__subscribers.pop(subscriber.sock.fileno(), None)
+        try:
+            self.__selector.unregister(subscriber.sock)
+        except (KeyError, ValueError):
+            pass
+        self.__event_log.info('subscriber %s disconnected, %s frames dropped',
+                              subscriber.sock.fileno(), subscriber.dropped)
+        subscriber.sock.close()
@@ -0,0 +1,186 @@
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+import threading
+import logging
+import atexit
+import queue
+import os
+
+
+class RateLimitFilter(logging.Filter):
+    """A logging filter that lets at most one record per message key
+    through every `interval` seconds. Only records logged with an explicit
+    key, `extra={'rate_key': key}`, are limited, every other record is let
+    through, so distinct events are never dropped.
+
+    Dropped records are counted. The count is appended to the next record
+    with the same key that is let through, or, if none comes, written in a
+    summary record once the interval expires (or at shutdown), so that
+    suppressed records never disappear without a trace.
+
+    Attributes:
+        interval -- A number. The minimum number of seconds between two
+                    records with the same message key.
+        emit -- A callable. Writes a summary record, bypassing filters.
+
+    Methods:
+        flush() -- Write a summary of every pending suppressed count.
+    """
+
+    def __init__(self, interval: float = 60.0, emit=None):
+        super().__init__()
+        self.interval = interval
+        self.emit = emit
+        self.__lock = threading.Lock()
+        self.__last_emit = {}
+        self.__suppressed = {}
+        self.__timers = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, 'rate_key', None)
+        if key is None:
+            return True
+
+        with self.__lock:
+            last_emit = self.__last_emit.get(key)
+            if (last_emit is not None and
+                    record.created - last_emit < self.interval):
+                count, _ = self.__suppressed.get(key, (0, None))
+                self.__suppressed[key] = (count + 1, record)
+                if key not in self.__timers and self.emit is not None:
+                    timer = threading.Timer(
+                        last_emit + self.interval - record.created,
+                        self.__flush_key, (key,))
+                    timer.daemon = True
+                    self.__timers[key] = timer
+                    timer.start()
+                return False
+            self.__last_emit[key] = record.created
+            suppressed, _ = self.__suppressed.pop(key, (0, None))
+            timer = self.__timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+
+        if suppressed:
+            self.__annotate(record, suppressed)
+        return True
+
+    def flush(self):
+        """Write a summary of every pending suppressed count now."""
+        with self.__lock:
+            keys = list(self.__suppressed)
+        for key in keys:
+            self.__flush_key(key)
+
+    def __flush_key(self, key):
+        """Write the last suppressed record of a key, with the number of
+        records suppressed, unless a record has been let through since."""
+        with self.__lock:
+            timer = self.__timers.pop(key, None)
+            suppressed, record = self.__suppressed.pop(key, (0, None))
+        if timer is not None:
+            timer.cancel()
+        if suppressed and self.emit is not None:
+            self.__annotate(record, suppressed)
+            self.emit(record)
+
+    @staticmethod
+    def __annotate(record: logging.LogRecord, suppressed: int):
+        record.msg = '{} (suppressed {} similar messages)'.format(
+            record.getMessage(), suppressed)
+        record.args = None
+
+
+class EventLog(object):
+    """Builds loggers whose records are handed to a queue and written to
+    file by a background `QueueListener` thread, so the calling thread
+    never waits on disk I/O.
+
+    One listener (and one file handler) is created per log file, the
+    first time a logger writing to it is requested. Classes request their
+    logger in `__init__`, so importing a module never creates the log
+    directory or starts a thread. All listeners are stopped, and their
+    queues drained, at interpreter exit.
+
+    Methods:
+        get_logger() -- Return a queue backed, rate limited logger.
+        shutdown() -- Flush and stop every listener.
+    """
+
+    FORMAT = '%(asctime)s %(levelname)s %(name)s.%(funcName)s() %(message)s'
+    LOG_DIR = 'logs/'
+
+    # Static Variables
+    __lock = threading.Lock()
+    __listeners = {}
+    __queues = {}
+    __filters = []
+
+    @staticmethod
+    def get_logger(name: str,
+                   file_name: str,
+                   level: int = logging.DEBUG,
+                   interval: float = 60.0) -> logging.Logger:
+        """Return the logger `name`, writing to `file_name` inside
+        `EventLog.LOG_DIR`. Calling this more than once for the same
+        logger is harmless, the handler is only attached once.
+
+        Arguments:
+            name -- A string. The name of the logger.
+            file_name -- A string. The log file records are written to.
+            level -- An int. The logging level of the logger.
+            interval -- A number. The rate limiting interval, in seconds,
+                        applied to records logged with a `rate_key`.
+        """
+        event_log = logging.getLogger(name)
+        with EventLog.__lock:
+            for handler in event_log.handlers:
+                if isinstance(handler, QueueHandler):
+                    return event_log
+
+            records = EventLog.__queues.get(file_name)
+            if records is None:
+                records = EventLog.__start_listener(file_name)
+
+            handler = QueueHandler(records)
+            rate_filter = RateLimitFilter(interval, handler.emit)
+            handler.addFilter(rate_filter)
+            EventLog.__filters.append(rate_filter)
+            event_log.setLevel(level)
+            event_log.addHandler(handler)
+        return event_log
+
+    @staticmethod
+    def shutdown():
+        """Stop every listener thread after writing all queued records,
+        including the counts of records still being suppressed."""
+        with EventLog.__lock:
+            for rate_filter in EventLog.__filters:
+                rate_filter.flush()
+            for listener in EventLog.__listeners.values():
+                listener.stop()
+            EventLog.__listeners.clear()
+            EventLog.__queues.clear()
+
+    @staticmethod
+    def __start_listener(file_name: str) -> queue.Queue:
+        """Create the queue, file handler and listener thread for a log
+        file. Must be called while holding the class lock.
+
+        Arguments:
+            file_name -- A string. The log file records are written to.
+        """
+        os.makedirs(EventLog.LOG_DIR, exist_ok=True)
+        handler = logging.FileHandler(
+            os.path.join(EventLog.LOG_DIR, file_name))
+        handler.setFormatter(logging.Formatter(fmt=EventLog.FORMAT))
+
+        records = queue.Queue(-1)
+        listener = QueueListener(records, handler)
+        listener.start()
+        EventLog.__queues[file_name] = records
+        EventLog.__listeners[file_name] = listener
+        return records
+
+
+atexit.register(EventLog.shutdown)
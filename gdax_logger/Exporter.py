@@ -0,0 +1,264 @@
+from .EventLog import EventLog
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, List
+from time import time
+import multiprocessing
+import sqlite3
+import queue
+import csv
+import logging
+import os
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = ('csv', 'parquet')
+
+
+def export_shard(db_path: str, table: str, start: float, end: float,
+                 include_end: bool, out_path: str, file_format: str,
+                 chunk_size: int, product_ids: List[str] = None,
+                 progress=None) -> int:
+    """Stream the rows of a table whose system_time is within [start, end)
+    (or [start, end] if `include_end`) to a single CSV or Parquet file, in
+    system_time order, and return the number of rows written.
+
+    Rows are read in chunks of `chunk_size` with keyset pagination (each
+    chunk starts after the last system_time of the previous one), so only
+    one chunk is ever held in memory and every chunk is an index range
+    scan on the primary key. No file is created for an empty shard.
+
+    Runs in a worker process, hence a module level function.
+
+    Arguments:
+        db_path -- A string. The SQLite database, opened read only.
+        table -- A string. The table to export.
+        start -- A number. The first system_time of the shard.
+        end -- A number. The system_time the shard stops at.
+        include_end -- A bool. Whether rows at `end` belong to the shard.
+        out_path -- A string. The file to write.
+        file_format -- A string. 'csv' or 'parquet'.
+        chunk_size -- An int. The number of rows read at a time.
+        product_ids -- A list of strings. Only export these products.
+        progress -- A queue. Receives the size of every written chunk.
+    """
+    connection = sqlite3.connect('file:{}?mode=ro'.format(db_path), uri=True)
+    columns = [(name, column_type.lower()) for _, name, column_type, *_
+               in connection.execute('PRAGMA table_info({})'.format(table))]
+    names = [name for name, _ in columns]
+
+    where = 'system_time {} ?'.format('<=' if include_end else '<')
+    params = [end]
+    if product_ids:
+        where += ' AND product_id IN ({})'.format(
+            ', '.join('?' * len(product_ids)))
+        params.extend(product_ids)
+    sql = 'SELECT {} FROM {} WHERE system_time {{}} ? AND {} ' \
+          'ORDER BY system_time LIMIT ?'.format(', '.join(names), table, where)
+    time_index = names.index('system_time')
+
+    writer = None
+    out_file = None
+    count = 0
+    last_time = start
+    comparison = '>='
+    try:
+        while True:
+            rows = connection.execute(
+                sql.format(comparison),
+                [last_time] + params + [chunk_size]).fetchall()
+            if not rows:
+                break
+            comparison = '>'
+            last_time = rows[-1][time_index]
+
+            if file_format == 'parquet':
+                if writer is None:
+                    schema = _parquet_schema(columns)
+                    writer = pyarrow.parquet.ParquetWriter(out_path, schema)
+                writer.write_table(pyarrow.Table.from_arrays(
+                    [pyarrow.array(values, type=field.type) for values, field
+                     in zip(zip(*rows), writer.schema)],
+                    schema=writer.schema))
+            else:
+                if writer is None:
+                    out_file = open(out_path, 'w', newline='')
+                    writer = csv.writer(out_file)
+                    writer.writerow(names)
+                writer.writerows(rows)
+
+            count += len(rows)
+            if progress is not None:
+                progress.put(len(rows))
+            if len(rows) < chunk_size:
+                break
+    finally:
+        connection.close()
+        if out_file is not None:
+            out_file.close()
+        elif writer is not None:
+            writer.close()
+    return count
+
+
+def _parquet_schema(columns: list):
+    """Return the Arrow schema of SQLite (name, declared type) columns."""
+    types = {'real': pyarrow.float64(), 'integer': pyarrow.int64(),
+             'text': pyarrow.string()}
+    return pyarrow.schema([(name, types.get(column_type, pyarrow.string()))
+                           for name, column_type in columns])
+
+
+class Exporter(object):
+    """Exports a table of `order_books.db` or `tickers.db` to sharded CSV
+    or Parquet files with bounded memory.
+
+    The requested time range is split into `shards` equal spans of
+    system_time, each streamed to its own file by a pool of worker
+    processes (see export_shard()), so the export uses several cores and
+    never holds more than one chunk per worker in memory.
+
+    Attributes:
+        db_path -- A string. The SQLite database to export from.
+        table -- A string. The table to export, e.g. 'order_books'.
+        out_dir -- A string. The directory shards are written to.
+        file_format -- A string. 'csv', or 'parquet' (needs pyarrow).
+        workers -- An int. The number of worker processes.
+        chunk_size -- An int. The number of rows read at a time.
+        shards -- An int. The number of output files, 4 per worker by
+                  default so that uneven shards still keep every worker
+                  busy.
+        overwrite -- A bool. Delete the shards of an earlier export of the
+                     table from `out_dir` first, rather than refusing to
+                     export into a directory that is not empty.
+
+    Methods:
+        run() -- Export a time range, reporting progress.
+    """
+
+    # Static Variable
+    __event_log = logging.getLogger(__name__)
+
+    def __init__(self,
+                 db_path: str,
+                 table: str = 'order_books',
+                 out_dir: str = 'export',
+                 file_format: str = 'csv',
+                 workers: int = None,
+                 chunk_size: int = 50000,
+                 shards: int = None,
+                 overwrite: bool = False):
+        EventLog.get_logger(__name__, 'Exporter.log')
+        if file_format not in FORMATS:
+            raise ValueError('unknown format: {}'.format(file_format))
+        if file_format == 'parquet' and pyarrow is None:
+            raise ValueError('parquet output needs pyarrow installed')
+        if not table.isidentifier():
+            raise ValueError('invalid table name: {}'.format(table))
+
+        self.db_path = db_path
+        self.table = table
+        self.out_dir = out_dir
+        self.file_format = file_format
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.shards = shards or 4 * self.workers
+        self.overwrite = overwrite
+
+    def run(self, start: float = None, end: float = None,
+            product_ids: List[str] = None,
+            on_progress: Callable[[int, float], None] = None) -> int:
+        """Export every row with a system_time within [start, end], and
+        return the number of rows written. Each shard is written to
+        `out_dir`/<table>-<shard>.<format>. Raises ValueError if `out_dir`
+        is not empty, unless `overwrite` is set, so that the shards of
+        an earlier export never mix with new ones.
+
+        Arguments:
+            start -- A number. The first epoch system_time, the oldest row
+                     by default.
+            end -- A number. The last epoch system_time, the newest row by
+                   default.
+            product_ids -- A list of strings. Only export these products.
+            on_progress -- A callable. Receives the rows written so far and
+                           the seconds elapsed, after every chunk.
+        """
+        first, last = self.__time_range()
+        start = first if start is None else start
+        end = last if end is None else end
+        if start is None or end is None or start > end:
+            return 0
+
+        self.__prepare_out_dir()
+        span = (end - start) / self.shards
+        bounds = [start + i * span for i in range(self.shards)] + [end]
+
+        began = time()
+        count = 0
+        with multiprocessing.Manager() as manager, \
+                ProcessPoolExecutor(max_workers=self.workers) as executor:
+            progress = manager.Queue()
+            pending = set()
+            for shard in range(self.shards):
+                out_path = os.path.join(self.out_dir, '{}-{:04d}.{}'.format(
+                    self.table, shard, self.file_format))
+                pending.add(executor.submit(
+                    export_shard, self.db_path, self.table, bounds[shard],
+                    bounds[shard + 1], shard == self.shards - 1, out_path,
+                    self.file_format, self.chunk_size, product_ids,
+                    progress))
+
+            while pending:
+                done, pending = wait(pending, timeout=1,
+                                     return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+                count += self.__drain(progress)
+                if on_progress is not None:
+                    on_progress(count, time() - began)
+            count += self.__drain(progress)
+
+        elapsed = time() - began
+        self.__event_log.info('exported %s rows of %s in %.1f s (%.0f rows/s)',
+                              count, self.table, elapsed,
+                              count / max(elapsed, 1e-9))
+        return count
+
+    def __prepare_out_dir(self):
+        """Create the output directory, or empty it of earlier shards of
+        the table if `overwrite` is set."""
+        os.makedirs(self.out_dir, exist_ok=True)
+        entries = os.listdir(self.out_dir)
+        if not entries:
+            return
+        if not self.overwrite:
+            raise ValueError('{} is not empty'.format(self.out_dir))
+
+        prefix = self.table + '-'
+        for name in entries:
+            stem, _, extension = name.rpartition('.')
+            if (stem.startswith(prefix) and extension in FORMATS and
+                    stem[len(prefix):].isdigit()):
+                os.remove(os.path.join(self.out_dir, name))
+
+    def __time_range(self) -> tuple:
+        connection = sqlite3.connect(
+            'file:{}?mode=ro'.format(self.db_path), uri=True)
+        try:
+            return connection.execute(
+                'SELECT MIN(system_time), MAX(system_time) FROM {}'.format(
+                    self.table)).fetchone()
+        finally:
+            connection.close()
+
+    @staticmethod
+    def __drain(progress) -> int:
+        count = 0
+        while True:
+            try:
+                count += progress.get_nowait()
+            except queue.Empty:
+                return count
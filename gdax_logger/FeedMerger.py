@@ -0,0 +1,443 @@
+from .GDAXConstants import GDAXConst
+from .EventLog import EventLog
+from collections import OrderedDict, deque
+from typing import Callable
+from time import time
+import threading
+import logging
+import queue
+import json
+
+
+class RecentKeys(object):
+    """The last `size` keys delivered on a stream, for constant time
+    membership tests. `floor` is the highest key evicted so far: a key at
+    or below it that is not held is too old to tell apart from a
+    duplicate."""
+    __slots__ = ('size', 'keys', 'order', 'floor')
+
+    def __init__(self, size: int):
+        self.size = size
+        self.keys = set()
+        self.order = deque()
+        self.floor = None
+
+    def __contains__(self, key) -> bool:
+        return key in self.keys
+
+    def expired(self, key) -> bool:
+        """Return whether a key is too old to be told apart from one
+        that was delivered and evicted."""
+        return self.floor is not None and key <= self.floor
+
+    def add(self, key):
+        self.keys.add(key)
+        self.order.append(key)
+        if len(self.order) > self.size:
+            evicted = self.order.popleft()
+            self.keys.discard(evicted)
+            if self.floor is None or evicted > self.floor:
+                self.floor = evicted
+
+
+class FeedMerger(object):
+    """Merges the messages of several redundant websocket connections
+    subscribed to the same channels into a single, duplicate free stream.
+
+    Messages are merged on the GDAX `sequence` field, and deduplicated
+    against the last `history` sequence numbers delivered per product. The
+    first copy of a sequence number to arrive, from any connection, is
+    delivered and every later copy is dropped. A message below the highest
+    sequence delivered that was never delivered itself is late, not a
+    duplicate: the connection that led lost it and another one caught it,
+    so it is delivered too.
+
+    Messages without a sequence number are merged on their `time` field
+    instead, deduplicated on their time and raw content against the last
+    `history` level2 updates delivered per product. A late level2 update
+    is delivered without the changes to price levels that a newer update
+    has already set, so that it never rolls a level back, and is dropped
+    if every change is superseded. Messages with neither (snapshots,
+    subscription replies) are deduplicated on their raw content among the
+    last `history` such messages. An update older than every one held is
+    treated as a duplicate from a lagging connection.
+
+    Merging happens under a lock, but delivery does not: merged messages
+    are queued and `on_message` and `on_gap` are called, in order, by a
+    separate thread. A slow consumer (a database write, a book rebuild)
+    therefore never holds up the connections.
+
+    When gap detection is enabled a message that skips ahead of the last
+    delivered sequence is held back until either another connection fills
+    the gap, every live connection has moved past the gap without filling
+    it, or the gap has been open for `max_delay` seconds, which is checked
+    on every push and by a timer, so a gap in a product that goes quiet is
+    still resolved. In the last two cases `on_gap` is called so that a
+    resnapshot can be requested, and the held messages are released in
+    sequence order. Gap detection is only
+    meaningful for channels whose per-product sequence numbers are
+    contiguous (the `full` channel). The `ticker`, `matches` and `level2`
+    channels skip sequence numbers by design.
+
+    Attributes:
+        on_message -- A callable. Receives each delivered raw message.
+        on_gap -- A callable. Receives a product id and the first and last
+                  missing sequence numbers of every unrecoverable gap.
+        detect_gaps -- A bool, or a set of the product ids whose sequence
+                       gaps are held and resolved.
+        max_delay -- A number. The longest a gap is waited on, in seconds.
+        max_pending -- An int. The most messages held back per product.
+
+    Methods:
+        connected() -- Register a (re)connected connection.
+        disconnected() -- Unregister a closed connection.
+        push() -- Merge a raw message received on a connection.
+        get_stats() -- Get delivered, duplicate, late and gap counts.
+        close() -- Deliver every queued message and stop.
+    """
+
+    # Static Variable
+    __event_log = logging.getLogger(__name__)
+
+    def __init__(self,
+                 on_message: Callable[[str], None],
+                 on_gap: Callable[[str, int, int], None] = None,
+                 detect_gaps=False,
+                 max_delay: float = 1.0,
+                 max_pending: int = 10000,
+                 history: int = 4096):
+        EventLog.get_logger(__name__, 'FeedMerger.log')
+        self.on_message = on_message
+        self.on_gap = on_gap
+        self.detect_gaps = detect_gaps
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+
+        self.__lock = threading.Lock()
+        self.__history = history
+        self.__recent = OrderedDict()
+        self.__recent_sequences = {}
+        self.__recent_updates = {}
+        self.__last_time = {}
+        self.__level_times = {}
+        self.__last_sequence = {}
+        self.__pending = {}
+        self.__gap_since = {}
+        self.__seen = {}
+        self.__timers = {}
+        self.__stats = {'delivered': 0, 'duplicates': 0, 'late': 0,
+                        'superseded': 0, 'gaps': 0}
+        self.__outbox = queue.Queue()
+        self.__thread = threading.Thread(target=self.__deliver_queued,
+                                         name='merger', daemon=True)
+        self.__thread.start()
+
+    def connected(self, connection_id: int):
+        """Start tracking a connection. Any state left over from a
+        previous session of the same connection is discarded.
+
+        Arguments:
+            connection_id -- An int. Identifies the connection.
+        """
+        with self.__lock:
+            self.__seen[connection_id] = {}
+        self.__event_log.info('connection %s live', connection_id)
+
+    def disconnected(self, connection_id: int):
+        """Stop tracking a connection. Gaps that were only waiting on this
+        connection are resolved.
+
+        Arguments:
+            connection_id -- An int. Identifies the connection.
+        """
+        with self.__lock:
+            self.__seen.pop(connection_id, None)
+            self.__resolve_gaps(time())
+        self.__event_log.info('connection %s closed', connection_id)
+
+    def push(self, connection_id: int, data: str):
+        """Merge a raw message received on a connection, delivering it
+        (and any held back messages it releases) through `on_message`.
+
+        Arguments:
+            connection_id -- An int. Identifies the connection.
+            data -- A string. The raw JSON message.
+        """
+        message = json.loads(data)
+        sequence = message.get(GDAXConst.sequence)
+        product_id = message.get(GDAXConst.product_id)
+
+        # A ticker message repeats the sequence number of its match, so
+        # tickers are merged as a separate stream, without gap detection.
+        stream = product_id
+        detect_gaps = self.__detects_gaps(product_id)
+        if message.get(GDAXConst.type_) == GDAXConst.ticker:
+            stream = '{}.{}'.format(product_id, GDAXConst.ticker)
+            detect_gaps = False
+
+        with self.__lock:
+            if self.__pending:
+                self.__resolve_gaps(time())
+
+            if sequence is None or product_id is None:
+                self.__push_unsequenced(product_id, message, data)
+                return
+
+            seen = self.__seen.setdefault(connection_id, {})
+            if sequence > seen.get(stream, 0):
+                seen[stream] = sequence
+
+            recent = self.__recent_sequences.get(stream)
+            if recent is None:
+                recent = self.__recent_sequences[stream] = RecentKeys(
+                    self.__history)
+            last = self.__last_sequence.get(stream)
+            pending = self.__pending.get(stream)
+            if (sequence in recent or recent.expired(sequence) or
+                    pending is not None and sequence in pending):
+                self.__stats['duplicates'] += 1
+                return
+
+            if last is not None and sequence <= last:
+                self.__stats['late'] += 1
+                recent.add(sequence)
+                self.__stats['delivered'] += 1
+                self.__outbox.put((self.on_message, (data,)))
+                return
+
+            if last is None or sequence == last + 1 or not detect_gaps:
+                self.__deliver(stream, sequence, data)
+                if pending:
+                    self.__release(stream)
+                return
+
+            if pending is None:
+                pending = self.__pending[stream] = {}
+                self.__gap_since[stream] = time()
+                self.__start_timer(stream)
+            pending[sequence] = data
+            self.__resolve_gap(stream, time())
+
+    def get_stats(self) -> dict:
+        """Return the number of delivered messages, dropped duplicates,
+        late messages (delivered after a newer one, and counted as
+        delivered), late level2 updates dropped as superseded, and
+        unrecoverable gaps seen so far.
+        """
+        with self.__lock:
+            return dict(self.__stats)
+
+    def close(self):
+        """Deliver every message merged so far, then stop the delivery
+        thread and any gap timers."""
+        with self.__lock:
+            for timer in self.__timers.values():
+                timer.cancel()
+            self.__timers.clear()
+        self.__outbox.put(None)
+        self.__thread.join()
+
+    def __deliver_queued(self):
+        """Call `on_message` and `on_gap` for every queued delivery, in
+        the order they were merged."""
+        while True:
+            delivery = self.__outbox.get()
+            if delivery is None:
+                return
+            callback, args = delivery
+            try:
+                callback(*args)
+            except Exception:
+                self.__event_log.exception('delivery failed')
+
+    def __start_timer(self, stream: str):
+        """Resolve a stream's gap once `max_delay` has passed, even if no
+        other message arrives. Must be called holding the lock."""
+        timer = threading.Timer(self.max_delay, self.__on_timer, (stream,))
+        timer.daemon = True
+        self.__timers[stream] = timer
+        timer.start()
+
+    def __on_timer(self, stream: str):
+        with self.__lock:
+            self.__timers.pop(stream, None)
+            if stream in self.__pending:
+                self.__resolve_gap(stream, time())
+                if stream in self.__pending and stream not in self.__timers:
+                    self.__start_timer(stream)
+
+    def __resolve_gaps(self, now: float):
+        """Resolve the open gap of every stream that can be given up on.
+        Must be called holding the lock."""
+        for stream in list(self.__pending):
+            self.__resolve_gap(stream, now)
+
+    def __detects_gaps(self, product_id: str) -> bool:
+        """Return whether sequence gaps are resolved for a product."""
+        if isinstance(self.detect_gaps, bool):
+            return self.detect_gaps
+        return product_id in self.detect_gaps
+
+    def __push_unsequenced(self, product_id: str, message: dict,
+                           data: str):
+        """Deliver a message without a sequence number, unless an
+        identical message was already delivered. Must be called holding
+        the lock.
+
+        Arguments:
+            product_id -- A string. The product of the message, or None.
+            message -- A dictionary. The decoded message.
+            data -- A string. The raw JSON message.
+        """
+        message_time = message.get(GDAXConst.time)
+        if product_id is not None and message_time is not None:
+            key = (message_time, data)
+            recent = self.__recent_updates.get(product_id)
+            if recent is None:
+                recent = self.__recent_updates[product_id] = RecentKeys(
+                    self.__history)
+            if key in recent or recent.expired(key):
+                self.__stats['duplicates'] += 1
+                return
+            recent.add(key)
+
+            # GDAX times have a fixed format, so they sort as strings.
+            last_time = self.__last_time.get(product_id)
+            if last_time is not None and message_time < last_time:
+                data = self.__unsuperseded(product_id, message, data)
+                if data is None:
+                    self.__stats['superseded'] += 1
+                    return
+                self.__stats['late'] += 1
+            else:
+                self.__last_time[product_id] = message_time
+            self.__track_levels(product_id, message, recent)
+
+        else:
+            if data in self.__recent:
+                self.__stats['duplicates'] += 1
+                return
+            self.__recent[data] = None
+            if len(self.__recent) > self.__history:
+                self.__recent.popitem(last=False)
+
+        self.__stats['delivered'] += 1
+        self.__outbox.put((self.on_message, (data,)))
+
+    def __unsuperseded(self, product_id: str, message: dict,
+                       data: str) -> str:
+        """Return a late level2 update without the changes to levels that
+        a newer update has set, or None if no change is left. Must be
+        called holding the lock."""
+        changes = message.get(GDAXConst.changes)
+        if not changes:
+            return data
+        message_time = message[GDAXConst.time]
+        level_times = self.__level_times.get(product_id, {})
+        fresh = [change for change in changes
+                 if level_times.get((change[0], change[1]), '') <
+                 message_time]
+        if not fresh:
+            return None
+        if len(fresh) == len(changes):
+            return data
+        return json.dumps(dict(message, changes=fresh))
+
+    def __track_levels(self, product_id: str, message: dict,
+                       recent: RecentKeys):
+        """Record the time each price level of a delivered level2 update
+        was last set. Levels set before every update still held can no
+        longer be compared against, and are forgotten. Must be called
+        holding the lock."""
+        changes = message.get(GDAXConst.changes)
+        if not changes:
+            return
+        level_times = self.__level_times.setdefault(product_id, {})
+        message_time = message[GDAXConst.time]
+        for side, price, *_ in changes:
+            if level_times.get((side, price), '') < message_time:
+                level_times[(side, price)] = message_time
+
+        if len(level_times) > 4 * self.__history and recent.floor:
+            floor_time = recent.floor[0]
+            for level in [level for level, level_time in level_times.items()
+                          if level_time <= floor_time]:
+                del level_times[level]
+
+    def __deliver(self, product_id: str, sequence: int, data: str):
+        """Deliver a message and advance the product's sequence number.
+        Must be called holding the lock.
+
+        Arguments:
+            product_id -- A string. The product the message belongs to.
+            sequence -- An int. The sequence number of the message.
+            data -- A string. The raw JSON message.
+        """
+        self.__last_sequence[product_id] = sequence
+        recent = self.__recent_sequences.get(product_id)
+        if recent is None:
+            recent = self.__recent_sequences[product_id] = RecentKeys(
+                self.__history)
+        recent.add(sequence)
+        self.__stats['delivered'] += 1
+        self.__outbox.put((self.on_message, (data,)))
+
+    def __release(self, product_id: str):
+        """Deliver held back messages that directly follow the last
+        delivered sequence number. Must be called holding the lock.
+
+        Arguments:
+            product_id -- A string. The product to release messages for.
+        """
+        pending = self.__pending[product_id]
+        last = self.__last_sequence[product_id]
+        while last + 1 in pending:
+            last += 1
+            self.__deliver(product_id, last, pending.pop(last))
+
+        # Messages at or below the last sequence can no longer be used.
+        for sequence in [s for s in pending if s <= last]:
+            del pending[sequence]
+
+        if pending:
+            self.__gap_since[product_id] = time()
+        else:
+            del self.__pending[product_id]
+            del self.__gap_since[product_id]
+            timer = self.__timers.pop(product_id, None)
+            if timer is not None:
+                timer.cancel()
+
+    def __resolve_gap(self, product_id: str, now: float):
+        """Give up on the product's open gap if every live connection has
+        moved past it, it has been open too long, or too many messages are
+        held back. Must be called holding the lock.
+
+        Arguments:
+            product_id -- A string. The product with an open gap.
+            now -- A number. The current time.
+        """
+        while product_id in self.__pending:
+            pending = self.__pending[product_id]
+            first_held = min(pending)
+            missed_by_all = all(
+                seen.get(product_id, 0) >= first_held
+                for seen in self.__seen.values())
+            if not (missed_by_all or
+                    now - self.__gap_since[product_id] >= self.max_delay or
+                    len(pending) >= self.max_pending):
+                return
+
+            first_missing = self.__last_sequence[product_id] + 1
+            last_missing = first_held - 1
+            self.__stats['gaps'] += 1
+            self.__event_log.warning(
+                '%s missed sequence %s to %s on every connection',
+                product_id, first_missing, last_missing,
+                extra={'rate_key': ('gap', product_id)})
+            if self.on_gap is not None:
+                self.__outbox.put((self.on_gap, (product_id, first_missing,
+                                                 last_missing)))
+
+            self.__last_sequence[product_id] = last_missing
+            self.__release(product_id)
@@ -0,0 +1,325 @@
+from .GDAXConstants import GDAXConst
+from .OrderBook import OrderBook
+from .QueryPlan import price_to_index
+from collections import OrderedDict
+from typing import List
+import threading
+
+
+class Order(object):
+    """A single resting order. Kept to the fields the book needs."""
+    __slots__ = ('order_id', 'side', 'price_index', 'size')
+
+    def __init__(self, order_id: str, side: str, price_index: int,
+                 size: float):
+        self.order_id = order_id
+        self.side = side
+        self.price_index = price_index
+        self.size = size
+
+
+class PriceLevel(object):
+    """The orders resting at one price, in time priority (FIFO) order,
+    along with their summed size."""
+    __slots__ = ('price', 'price_index', 'volume', 'orders')
+
+    def __init__(self, price: str, price_index: int):
+        self.price = price
+        self.price_index = price_index
+        self.volume = 0.0
+        self.orders = OrderedDict()
+
+
+class Snapshot(object):
+    """The order index and price levels of a level 3 snapshot, built by
+    L3OrderBook.prepare_snapshot() apart from any book."""
+    __slots__ = ('orders', 'levels')
+
+    def __init__(self, orders: dict, levels: dict):
+        self.orders = orders
+        self.levels = levels
+
+
+class L3OrderBook(OrderBook):
+    """An order book built from every individual order, fed by the GDAX
+    `full` channel (received, open, done, match and change messages).
+
+    Orders are indexed by order id and queued per price level in time
+    priority. The aggregated volume of each level is kept in the volume
+    segment tree of the base `OrderBook`, so every depth query works
+    unchanged, and the number of orders at each level is kept in a second
+    segment tree of the same shape.
+
+    Methods:
+        init_book() -- Build the book from a level 3 snapshot.
+        prepare_snapshot() -- Index a level 3 snapshot for resync_book().
+        resync_book() -- Replace the book with a level 3 snapshot.
+        apply_message() -- Apply a `full` channel message.
+        get_order() -- Get a resting order by order id.
+        get_level() -- Get the orders resting at a price, in queue order.
+        get_order_count_in_range() -- Get the number of orders within a
+                                      price range.
+        queue_position() -- Get the orders and size ahead of an order.
+    """
+
+    MESSAGE_TYPES = (GDAXConst.received, GDAXConst.open_, GDAXConst.done,
+                     GDAXConst.match, GDAXConst.change)
+
+    # The REST snapshot level resync_book() expects.
+    snapshot_level = 3
+
+    def __init__(self, price_cap: float, currency: str, volume_tree=None):
+        super().__init__(price_cap, currency, volume_tree)
+        self.__book_lock = threading.Lock()
+        self.__price_points = int(price_cap * 100)
+        self.__count_seg_tree = [0] * (2 * self.__price_points)
+        self.__orders = {}
+        self.__levels = {}
+
+    def init_book(self, orders: dict):
+        """Builds the order index, the price level queues and both
+        segment trees from a level 3 snapshot.
+
+        Arguments:
+            orders -- A dictionary. Should contain 2 arrays, one
+                      containing the bid orders and one containing
+                      the ask orders. Each array contains triples in
+                      the following format: [price, size, order_id]
+        """
+        snapshot = self.prepare_snapshot(orders)
+        with self.__book_lock:
+            self.__orders = snapshot.orders
+            self.__levels = snapshot.levels
+
+            counts = [0] * self.__price_points
+            bids = []
+            asks = []
+            for price_index, level in self.__levels.items():
+                if 0 <= price_index < self.__price_points:
+                    counts[price_index] = len(level.orders)
+                side = next(iter(level.orders.values())).side
+                pairs = bids if side == GDAXConst.buy else asks
+                pairs.append([level.price, level.volume])
+
+            for i in range(0, self.__price_points):
+                self.__count_seg_tree[self.__price_points + i] = counts[i]
+            for i in range(self.__price_points - 1, 0, -1):
+                self.__count_seg_tree[i] = (self.__count_seg_tree[i << 1] +
+                                            self.__count_seg_tree[i << 1 | 1])
+
+            super().init_book({GDAXConst.bids: bids, GDAXConst.asks: asks})
+
+    def prepare_snapshot(self, orders: dict) -> Snapshot:
+        """Return the order index and price levels of a level 3
+        snapshot, without touching the book. This is the slow part of a
+        resync, so it can be done while the book's updates are buffered.
+
+        Arguments:
+            orders -- A dictionary. See init_book().
+        """
+        snapshot = Snapshot({}, {})
+        for side, key in ((GDAXConst.buy, GDAXConst.bids),
+                          (GDAXConst.sell, GDAXConst.asks)):
+            for price, size, order_id in orders[key]:
+                self.__add_order(order_id, side, price, float(size),
+                                 snapshot.orders, snapshot.levels)
+        return snapshot
+
+    def resync_book(self, orders):
+        """Replace the whole book with a level 3 snapshot, which is never
+        partial. The index and price levels are swapped in, and only the
+        price points whose volume or order count changed are rewritten in
+        the segment trees, so the book is held for a time proportional
+        to what changed since it was last in sync.
+
+        Arguments:
+            orders -- A Snapshot from prepare_snapshot(), or a dictionary
+                      (see init_book()).
+        """
+        if not isinstance(orders, Snapshot):
+            orders = self.prepare_snapshot(orders)
+
+        with self.__book_lock:
+            old_levels = self.__levels
+            self.__orders = orders.orders
+            self.__levels = orders.levels
+
+            volumes = {}
+            nodes = set()
+            for price_index in old_levels.keys() | self.__levels.keys():
+                if not 0 <= price_index < self.__price_points:
+                    continue
+                old = old_levels.get(price_index)
+                new = self.__levels.get(price_index)
+                volume = 0.0 if new is None else max(new.volume, 0.0)
+                count = 0 if new is None else len(new.orders)
+                if (old is None or old.volume != volume or
+                        len(old.orders) != count):
+                    volumes[price_index] = volume
+                    leaf_index = self.__price_points + price_index
+                    self.__count_seg_tree[leaf_index] = count
+                    nodes.add(leaf_index >> 1)
+
+            while nodes and nodes != {0}:
+                for i in nodes:
+                    self.__count_seg_tree[i] = (
+                        self.__count_seg_tree[i << 1] +
+                        self.__count_seg_tree[i << 1 | 1])
+                nodes = {i >> 1 for i in nodes}
+
+            self.set_levels(volumes)
+
+    def apply_message(self, data: dict):
+        """Apply a `full` channel message to the book. Received messages
+        and orders that never rested on the book are ignored.
+
+        Arguments:
+            data -- A dictionary. The decoded websocket message.
+        """
+        message_type = data[GDAXConst.type_]
+        with self.__book_lock:
+            if message_type == GDAXConst.open_:
+                level = self.__add_order(
+                    data[GDAXConst.order_id], data[GDAXConst.side],
+                    data[GDAXConst.price],
+                    float(data[GDAXConst.remaining_size]))
+                self.__sync_level(level)
+
+            elif message_type == GDAXConst.done:
+                order = self.__orders.pop(data[GDAXConst.order_id], None)
+                if order is not None:
+                    level = self.__levels[order.price_index]
+                    del level.orders[order.order_id]
+                    level.volume -= order.size
+                    self.__sync_level(level)
+
+            elif message_type == GDAXConst.match:
+                self.__resize_order(data[GDAXConst.maker_order_id],
+                                    -float(data[GDAXConst.size]))
+
+            elif message_type == GDAXConst.change:
+                order = self.__orders.get(data[GDAXConst.order_id])
+                if (order is not None and
+                        data.get(GDAXConst.new_size) is not None):
+                    self.__resize_order(
+                        order.order_id,
+                        float(data[GDAXConst.new_size]) - order.size)
+
+    def get_order(self, order_id: str) -> Order:
+        """Return the resting order with the input order id, or None.
+
+        Arguments:
+            order_id -- A string. The id of the order.
+        """
+        return self.__orders.get(order_id)
+
+    def get_level(self, price: float) -> List[Order]:
+        """Return the orders resting at the input price, in queue order.
+
+        Arguments:
+            price -- A number. The price of the level.
+        """
+        with self.__book_lock:
+            level = self.__levels.get(price_to_index(price))
+            return [] if level is None else list(level.orders.values())
+
+    def get_order_count_in_range(self,
+                                 lower_price_bound: float,
+                                 upper_price_bound: float) -> int:
+        """Return the number of orders resting within the input price
+        range, bounds included.
+
+        Arguments:
+            lower_price_bound - A number. The lower bound of the range.
+            upper_price_bound - A number. The upper bound of the range.
+        """
+        left_index = max(price_to_index(lower_price_bound), 0)
+        right_index = min(price_to_index(upper_price_bound) + 1,
+                          self.__price_points)
+        left_index += self.__price_points
+        right_index += self.__price_points
+
+        count = 0
+        while left_index < right_index:
+            if left_index & 1:
+                count += self.__count_seg_tree[left_index]
+                left_index += 1
+            if right_index & 1:
+                right_index -= 1
+                count += self.__count_seg_tree[right_index]
+            left_index >>= 1
+            right_index >>= 1
+        return count
+
+    def queue_position(self, order_id: str) -> tuple:
+        """Return the number of orders and the total size queued ahead of
+        an order at its price level, or None if the order is not resting.
+
+        Arguments:
+            order_id -- A string. The id of the order.
+        """
+        with self.__book_lock:
+            order = self.__orders.get(order_id)
+            if order is None:
+                return None
+
+            orders_ahead = 0
+            size_ahead = 0.0
+            for queued in self.__levels[order.price_index].orders.values():
+                if queued is order:
+                    break
+                orders_ahead += 1
+                size_ahead += queued.size
+            return orders_ahead, size_ahead
+
+    def __add_order(self, order_id: str, side: str, price: str,
+                    size: float, orders: dict = None,
+                    levels: dict = None) -> PriceLevel:
+        """Index an order and append it to the back of its price level,
+        in the book or in the input index and levels. Must be called
+        holding the book lock when adding to the book.
+        """
+        if orders is None:
+            orders = self.__orders
+            levels = self.__levels
+        price_index = price_to_index(price)
+        level = levels.get(price_index)
+        if level is None:
+            level = levels[price_index] = PriceLevel(price, price_index)
+
+        order = Order(order_id, side, price_index, size)
+        orders[order_id] = order
+        level.orders[order_id] = order
+        level.volume += size
+        return level
+
+    def __resize_order(self, order_id: str, size_change: float):
+        """Change the size of a resting order, keeping its place in the
+        queue. Must be called holding the book lock.
+        """
+        order = self.__orders.get(order_id)
+        if order is None:
+            return
+        order.size += size_change
+        level = self.__levels[order.price_index]
+        level.volume += size_change
+        self.__sync_level(level)
+
+    def __sync_level(self, level: PriceLevel):
+        """Write a level's volume and order count to the segment trees,
+        dropping the level once it is empty. Must be called holding the
+        book lock.
+        """
+        price_index = level.price_index
+        if not level.orders:
+            level.volume = 0.0
+            del self.__levels[price_index]
+
+        self.update_volume(level.price, max(level.volume, 0.0))
+        if 0 <= price_index < self.__price_points:
+            i = self.__price_points + price_index
+            self.__count_seg_tree[i] = len(level.orders)
+            while i > 1:
+                self.__count_seg_tree[i >> 1] = (self.__count_seg_tree[i] +
+                                                 self.__count_seg_tree[i ^ 1])
+                i >>= 1
@@ -1,5 +1,11 @@
 from .GDAXConstants import GDAXConst
-from .OrderBook import OrderBook
+from .L3OrderBook import L3OrderBook
+from .MultiBook import MultiBook
+from .DepthPublisher import DepthPublisher
+from .RestClient import RestClient
+from .RingBuffer import RingBuffer
+from .Database import Database
+from .EventLog import EventLog
 from datetime import datetime
 from sqlite3 import Error
 from time import sleep
@@ -7,37 +13,109 @@ from time import time
 import threading
 import requests
 import sqlite3
-import logging
+import queue
 import json
+import logging
 import os
 
 
 class LoggerHandler(object):
     _event_log = logging.getLogger(__name__)
 
-    def __init__(self):
-        # Initialize Logging environment
-        fmt = '%(asctime)s %(levelname)s %(name)s.%(funcName)s() %(message)s'
-        formatter = logging.Formatter(fmt=fmt)
-        handler = logging.FileHandler(os.path.join('logs/', 'Handler.log'))
-        handler.setFormatter(formatter)
-        _event_log = logging.getLogger(__name__)
-        _event_log.setLevel(logging.DEBUG)
-        _event_log.addHandler(handler)
-
+    def __init__(self,
+                 rest_url=GDAXConst.Live.rest_url,
+                 full_products=(),
+                 publish_address=None,
+                 event_sampling=False,
+                 min_interval=0.1,
+                 max_interval=5.0,
+                 near_percent=0.1,
+                 depth_threshold=0.05,
+                 price_threshold=0.0005,
+                 ring_dir=None,
+                 ring_capacity=100000,
+                 on_resnapshot=None):
+        """
+        Arguments:
+            rest_url -- A string. The REST API books are resynced from,
+                        defaults to the live exchange.
+            full_products -- A list of product ids fed by the `full`
+                             channel instead of `level2`. These get a level
+                             3 order book, and since the `full` channel
+                             carries every sequence number, any skipped
+                             sequence number is a missed message.
+            publish_address -- A string. If given, every sampled depth row
+                               and ticker is also published to local
+                               subscribers on this socket path or
+                               'host:port' (see DepthPublisher).
+            event_sampling -- A bool. Sample a book when it changes
+                              significantly instead of about once per
+                              second.
+            min_interval -- A number. The least time between two samples
+                            of a book when event sampling, in seconds.
+            max_interval -- A number. The most time between two samples
+                            of a book when event sampling, in seconds.
+            near_percent -- A number. The band around market price, in
+                            percent, whose depth is watched for changes.
+            depth_threshold -- A number. The relative near touch depth
+                               change that triggers a sample.
+            price_threshold -- A number. The relative market price change
+                               that triggers a sample.
+            ring_dir -- A string. If given, the latest `ring_capacity`
+                        depth rows of each product are also kept in a
+                        memory mapped ring file in this directory (see
+                        RingBuffer), named after the product.
+            ring_capacity -- An int. The number of rows each ring holds.
+            on_resnapshot -- A callable. Receives the product id of a
+                             level2 book that missed an update, and should
+                             resubscribe to its level2 channel so that the
+                             feed sends a fresh snapshot. level2 updates
+                             carry no sequence number, so such a book
+                             cannot be resynced from REST.
+        """
+        EventLog.get_logger(__name__, 'Handler.log')
         # Initialize class variables
         self.__closed = False
         self.__post_to_slack = False
         self.__slack_url = ''
         self.__last_error = (time() - 300)
+        self.__REJECTION_INTERVAL = 60
+        self.__last_rejection_report = time()
         self.__DB_TIMEOUT = 0.15
+        self.__MAX_RESYNC_BUFFER = 100000
         self.__OB_PATH = 'order_books.db'
         self.__TICKER_PATH = 'tickers.db'
         self.__logger_thread = threading.Thread(
-            target=self.__query_thread, daemon=True)
+            target=self.__query_thread, name='query', daemon=True)
+
+        # Initialize sequence tracking and resync state
+        self.__rest_client = RestClient(rest_url)
+        self.__full_products = set(full_products)
+        self.__on_resnapshot = on_resnapshot
+        self.__unsynced = set(full_products)
+        self.__awaiting_snapshot = set()
+
+        # Initialize event driven sampling
+        self.__event_sampling = event_sampling
+        self.__min_interval = min_interval
+        self.__max_interval = max_interval
+        self.__book_changed = threading.Event()
+
+        # Initialize the local publisher
+        self.__publisher = None
+        if publish_address is not None:
+            self.__publisher = DepthPublisher(publish_address)
+        self.__sequences = {}
+        self.__trade_ids = {}
+        self.__resync_buffers = {}
+        self.__resync_queue = queue.Queue()
+        self.__sync_lock = threading.Lock()
+        self.__resync_thread = threading.Thread(
+            target=self.__resync_books, name='resync', daemon=True)
 
         # Initialize Databasse
         sqlite3.enable_callback_tracebacks(True)
+        self.__depth_fields = []
         self.__init_database()
 
         # Initialize order books and loggers
@@ -48,25 +126,51 @@ class LoggerHandler(object):
             GDAXConst.ltc_usd,
             GDAXConst.bch_usd
         ]
-        self._order_books = {
-            GDAXConst.btc_usd: OrderBook(50000, GDAXConst.btc_usd),
-            GDAXConst.eth_usd: OrderBook(10000, GDAXConst.eth_usd),
-            GDAXConst.ltc_usd: OrderBook(5000, GDAXConst.ltc_usd),
-            GDAXConst.bch_usd: OrderBook(20000, GDAXConst.bch_usd)
+        price_caps = {
+            GDAXConst.btc_usd: 50000,
+            GDAXConst.eth_usd: 10000,
+            GDAXConst.ltc_usd: 5000,
+            GDAXConst.bch_usd: 20000
         }
+        book_types = dict.fromkeys(self.__full_products, L3OrderBook)
+        self.__multi_book = MultiBook(price_caps, book_types)
+        self._order_books = self.__multi_book.books
+        for book in self._order_books.values():
+            book.set_twap_ranges(self.percent_ranges)
+            if event_sampling:
+                book.set_change_trigger(self.__book_changed, near_percent,
+                                        depth_threshold, price_threshold)
         self.ticker_columns = [
             GDAXConst.system_time, GDAXConst.server_time, GDAXConst.product_id,
             GDAXConst.price, GDAXConst.open_24h, GDAXConst.volume_24h,
             GDAXConst.best_bid, GDAXConst.best_ask, GDAXConst.side,
             GDAXConst.last_size
         ]
+
+        # Initialize the ring files, one float64 field per numeric column
+        self.__rings = {}
+        if ring_dir is not None:
+            for product_id in self.product_ids:
+                self.__rings[product_id] = RingBuffer(
+                    os.path.join(ring_dir, product_id + '.ring'),
+                    self.__depth_fields, ring_capacity)
+
+        if self.__publisher is not None:
+            self.__publisher.start()
         self.__logger_thread.start()
+        self.__resync_thread.start()
         self._event_log.debug("initialized...")
 
     def close(self):
         self._event_log.info('stopping...')
         self.__closed = True
         self.__logger_thread.join()
+        self.__resync_thread.join()
+        self.__rest_client.close()
+        if self.__publisher is not None:
+            self.__publisher.close()
+        for ring in self.__rings.values():
+            ring.close()
 
     def is_running(self):
         return not self.__closed
@@ -92,25 +196,201 @@ class LoggerHandler(object):
         path = self.__TICKER_PATH
 
         self.__write_to_db(path, sql, row)
+        if self.__publisher is not None:
+            self.__publisher.publish_ticker(fdata)
 
     def update_order_book(self, data):
         data = json.loads(data)
+        product = data.get(GDAXConst.product_id)
+        if product not in self.product_ids:
+            return
+
+        with self.__sync_lock:
+            gap = self.__check_sequence(product, data)
+            if gap is None:
+                return
+            if gap:
+                self.__request_resync(product)
+
+            # The full channel sends no snapshot, level 3 books are built
+            # from REST once the first message is buffered, so that the
+            # snapshot can be checked to connect to the feed.
+            if (product in self.__unsynced and
+                    data['type'] in L3OrderBook.MESSAGE_TYPES):
+                self.__unsynced.discard(product)
+                self.__request_resync(product)
+            if GDAXConst.snapshot in data['type']:
+                self.__awaiting_snapshot.discard(product)
+
+            # Updates to a book that is being resynced are replayed
+            # once its snapshot arrives.
+            if product in self.__resync_buffers:
+                buffered = self.__resync_buffers[product]
+                if len(buffered) >= self.__MAX_RESYNC_BUFFER:
+                    # The snapshot then has to cover the messages that
+                    # follow instead, see __covers().
+                    self._event_log.warning(
+                        '%s resync buffer full, dropped %s updates',
+                        product, len(buffered),
+                        extra={'rate_key': ('resync_buffer', product)})
+                    buffered.clear()
+                buffered.append(data)
+                return
+
+            self.__apply_update(product, data)
+
+    def __apply_update(self, product, data):
+        if (product in self.__full_products and
+                data['type'] in L3OrderBook.MESSAGE_TYPES):
+            self._order_books[product].apply_message(data)
+
         if GDAXConst.l2update in data['type']:
-            product = data['product_id']
             price = data['changes'][0][1]
             volume = data['changes'][0][2]
-            if product in self.product_ids:
-                self._order_books[product].update_volume(price, volume)
+            self._order_books[product].update_volume(price, volume)
 
         if GDAXConst.match in data['type']:
-            product = data['product_id']
-            if product in self.product_ids:
-                self._order_books[product].update_market_price(data['price'])
+            self._order_books[product].update_market_price(data['price'])
 
         if GDAXConst.snapshot in data['type']:
-            product = data['product_id']
-            if product in self.product_ids:
-                self._order_books[product].init_book(data)
+            self._order_books[product].init_book(data)
+
+    def __check_sequence(self, product, data):
+        """Return True if the message shows that an earlier message for
+        the product was missed, None if the message is a duplicate or
+        older than one already applied, and False otherwise.
+
+        Sequence numbers are only contiguous on the `full` channel, so on
+        the other channels a gap is detected from the trade ids of
+        consecutive matches instead.
+        """
+        gap = False
+        sequence = data.get(GDAXConst.sequence)
+        if sequence is not None:
+            last = self.__sequences.get(product)
+            if last is not None and sequence <= last:
+                return None
+            self.__sequences[product] = sequence
+            gap = (product in self.__full_products and
+                   last is not None and sequence > last + 1)
+
+        trade_id = data.get(GDAXConst.trade_id)
+        if trade_id is not None and GDAXConst.match in data['type']:
+            last = self.__trade_ids.get(product)
+            self.__trade_ids[product] = trade_id
+            gap = gap or (last is not None and trade_id > last + 1)
+
+        return gap
+
+    def __request_resync(self, product):
+        """Mark a product's book as stale and queue a resync, unless one
+        is already in progress. Must be called holding the sync lock.
+
+        Books on the full channel are resynced from a REST snapshot, with
+        the updates received meanwhile buffered for replay. level2 books
+        are resynced from a snapshot the feed sends after resubscribing,
+        and keep applying updates until it arrives.
+        """
+        if (product in self.__resync_buffers or
+                product in self.__awaiting_snapshot):
+            return
+
+        self._event_log.warning('%s order book out of sync, resyncing',
+                                product,
+                                extra={'rate_key': ('resync', product)})
+        self._order_books[product].mark_stale()
+        if product in self.__full_products:
+            self.__resync_buffers[product] = []
+        else:
+            self.__awaiting_snapshot.add(product)
+        self.__resync_queue.put(product)
+
+    def __resync_books(self):
+        """Resync stale order books on the full channel from REST
+        snapshots, replaying the updates buffered while each snapshot was
+        fetched, and request a websocket snapshot for level2 books."""
+        while not self.__closed:
+            try:
+                product = self.__resync_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            try:
+                if product not in self.__full_products:
+                    self.__resnapshot(product)
+                elif not self.__resync_book(product):
+                    self.__resync_queue.put(product)
+                    sleep(1)
+            except Exception as e:
+                self._event_log.exception('%s resync failed: %s', product, e)
+                if product in self.__full_products:
+                    self.__resync_queue.put(product)
+                sleep(1)
+
+    def __resync_book(self, product):
+        """Resync a book on the full channel from a REST snapshot and
+        replay the updates buffered since, returning whether it worked.
+        A snapshot that does not reach the first buffered update, or a
+        buffer with a gap after the snapshot, is discarded, so that a
+        missed update is never skipped silently."""
+        order_book = self._order_books[product]
+        snapshot = self.__rest_client.get_order_book(
+            product, level=order_book.snapshot_level)
+        if snapshot is None:
+            return False
+
+        # Index the snapshot before taking the lock, updates are still
+        # buffered meanwhile.
+        prepared = order_book.prepare_snapshot(snapshot)
+        snapshot_sequence = snapshot[GDAXConst.sequence]
+        with self.__sync_lock:
+            buffered = self.__resync_buffers.get(product, [])
+            if not self.__covers(snapshot_sequence, buffered):
+                self._event_log.info(
+                    '%s snapshot at sequence %s does not connect to the '
+                    'buffered updates, refetching', product,
+                    snapshot_sequence)
+                return False
+
+            order_book.resync_book(prepared)
+            del self.__resync_buffers[product]
+            for data in buffered:
+                sequence = data.get(GDAXConst.sequence)
+                if sequence is None or sequence > snapshot_sequence:
+                    self.__apply_update(product, data)
+            self.__sequences[product] = max(
+                self.__sequences.get(product, 0), snapshot_sequence)
+        self._event_log.info('%s resynced at sequence %s, replayed %s',
+                             product, snapshot_sequence, len(buffered))
+        return True
+
+    @staticmethod
+    def __covers(snapshot_sequence, buffered):
+        """Return whether a snapshot and the updates buffered after it
+        leave no sequence number out."""
+        needed = snapshot_sequence + 1
+        for data in buffered:
+            sequence = data.get(GDAXConst.sequence)
+            if sequence is None or sequence < needed:
+                continue
+            if sequence > needed:
+                return False
+            needed += 1
+        return True
+
+    def __resnapshot(self, product):
+        """Ask the feed for a fresh level2 snapshot of a product. The
+        book stays stale until one arrives if that is not possible."""
+        if self.__on_resnapshot is None:
+            self._event_log.warning('%s cannot be resnapshotted, waiting for '
+                                    'the feed to reconnect', product)
+            return
+        try:
+            self.__on_resnapshot(product)
+        except Exception as e:
+            self._event_log.exception('%s resnapshot failed: %s', product, e)
+            with self.__sync_lock:
+                self.__awaiting_snapshot.discard(product)
 
     def __create_connection(self, db_file, timeout=None):
         if timeout is None:
@@ -120,21 +400,17 @@ class LoggerHandler(object):
             return connection
         except Error as e:
             self._event_log.critical(
-                'unable to connect to {} due to \"{}\"'.format(db_file, e))
+                'unable to connect to %s due to \"%s\"', db_file, e)
         return None
 
     def __init_database(self):
         self._event_log.info('Attempting to initialize database...')
 
         path = self.__TICKER_PATH
-        sql = """CREATE TABLE IF NOT EXISTS tickers
-            (system_time real PRIMARY KEY, server_time text, product_id text,
-            price real, open_24h real, volume_24h real, best_bid real,
-            best_ask real, side text, last_size real);"""
-        status = self.__write_to_db(path, sql)
+        status = self.__write_to_db(path, Database.TICKERS_TABLE)
         if status is None:
             self._event_log.critical(
-                'Failed to create `tickers` table in {}'.format(path))
+                'Failed to create `tickers` table in %s', path)
             raise Exception
 
         sql = """CREATE TABLE IF NOT EXISTS order_books (
@@ -150,10 +426,36 @@ class LoggerHandler(object):
         status = self.__write_to_db(path, sql)
         if status is None:
             self._event_log.critical(
-                'Failed to create `order_books` table in {}'.format(path))
+                'Failed to create `order_books` table in %s', path)
             raise Exception
 
+        # Time weighted average depth columns, added to existing tables
+        connection = self.__create_connection(path)
+        columns = [column[1] for column in connection.execute(
+            'PRAGMA table_info(order_books)')]
+        connection.close()
+        for side in ('buy', 'sell'):
+            for suffix in ('0001', '0005', '0010', '0050', '0100', '0250',
+                           '0500', '1000', '2500'):
+                column = 'twap_{}_vol_{}'.format(side, suffix)
+                if column not in columns:
+                    sql = 'ALTER TABLE order_books ADD COLUMN {} real'.format(
+                        column)
+                    if self.__write_to_db(path, sql) is None:
+                        self._event_log.critical(
+                            'Failed to add `%s` to `order_books` in %s',
+                            column, path)
+                        raise Exception
+                    columns.append(column)
+        self.__depth_fields = [
+            column for column in columns
+            if column not in (GDAXConst.product_id, GDAXConst.server_time)]
+
     def __query_thread(self):
+        if self.__event_sampling:
+            self.__sample_on_change()
+            return
+
         while not self.__closed:
             self.__query_order_books()
             sleep(0.9835)
@@ -163,35 +465,99 @@ class LoggerHandler(object):
             of each other. This value might not be optimal for your system.
             '''
 
+    def __sample_on_change(self):
+        """Sample each book once it has changed significantly, but no
+        more often than the minimum interval, and at least once per
+        maximum interval."""
+        last_sample = dict.fromkeys(self.product_ids, 0)
+        while not self.__closed:
+            self.__book_changed.wait(timeout=self.__min_interval)
+            self.__book_changed.clear()
+
+            now = time()
+            for product_id in self.product_ids:
+                order_book = self._order_books[product_id]
+                elapsed = now - last_sample[product_id]
+                if (elapsed >= self.__max_interval or
+                        elapsed >= self.__min_interval and
+                        order_book.changed()):
+                    if self.__sample_order_book(product_id):
+                        last_sample[product_id] = now
+            self.__check_rejections()
+
     def __query_order_books(self):
-        for product_id in self.product_ids:
-            order_book = self._order_books[product_id]
-            if not order_book.built():
-                continue
+        """Query every built, in sync book in one vectorized pass and
+        write their rows."""
+        product_ids = [
+            product_id for product_id in self.product_ids
+            if self._order_books[product_id].built() and
+            not self._order_books[product_id].is_stale()]
+        rows, _ = self.__multi_book.query(
+            self.percent_ranges, product_ids)
+        for row in rows:
+            self.__write_order_book_row(row)
+        self.__check_rejections()
+
+    def __sample_order_book(self, product_id):
+        """Query a book and write the row, unless the book is not built
+        yet or is stale. Returns whether a row was written."""
+        order_book = self._order_books[product_id]
+        if not order_book.built() or order_book.is_stale():
+            return False
+
+        self.__write_order_book_row(order_book.query(self.percent_ranges))
+        return True
 
-            row = tuple(order_book.query(self.percent_ranges))
-            sql = '''
-                INSERT INTO order_books VALUES (
-                ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
-                ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
-                )'''
-            self.__write_to_db(self.__OB_PATH, sql, row)
+    def __write_order_book_row(self, row):
+        """Append the book's TWAP depths to a queried row, then write and
+        publish it."""
+        row.extend(self._order_books[row[1]].pop_twap())
+        row = tuple(row)
+        sql = '''
+            INSERT INTO order_books VALUES (
+            ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+            ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+            ?, ?, ?, ?, ?, ?, ?, ?, ?,
+            ?, ?, ?, ?, ?, ?, ?, ?, ?
+            )'''
+        self.__write_to_db(self.__OB_PATH, sql, row)
+        if self.__publisher is not None:
+            self.__publisher.publish_depth(row)
+        ring = self.__rings.get(row[1])
+        if ring is not None:
+            ring.append((row[0],) + row[3:])
+
+    def __check_rejections(self):
+        if self.__last_rejection_report <= time() - self.__REJECTION_INTERVAL:
+            self.__last_rejection_report = time()
+            self.__report_rejections()
+
+    def __report_rejections(self):
+        """Log a one line summary of the updates each order book has
+        rejected since the last report."""
+        for product_id in self.product_ids:
+            rejections = self._order_books[product_id].pop_rejections()
+            if rejections:
+                self._event_log.warning(
+                    '%s rejected in the last %ss: %s', product_id,
+                    self.__REJECTION_INTERVAL, rejections,
+                    extra={'rate_key': ('rejections', product_id)})
 
     def __write_to_db(self, path, sql, row=None, timeout=None):
+        if timeout is None:
+            timeout = self.__DB_TIMEOUT
         try:
-            conn = self.__create_connection(path, timeout)
-            conn.execute(sql) if (row is None) else conn.execute(sql, row)
-            conn.commit()
-            conn.close()
+            Database.write(path, sql, None if row is None else [row], timeout)
             return True
         except sqlite3.Error as e:
-            self._event_log.critical('''{} @ {}
-            <SQL>{}
+            self._event_log.critical('''%s @ %s
+            <SQL>%s
             </SQL>
             <Data>
-            \t{}
+            \t%s
             </Data>
-            '''.format(e, time(), sql, row))
+            ''', e, time(), sql, row,
+                extra={'rate_key': ('database', path, str(e))})
 
             err = e.__str__()
             if "database is locked" not in err and "UNIQUE" not in err:
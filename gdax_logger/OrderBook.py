@@ -1,10 +1,13 @@
+from .QueryPlan import QueryPlan, leaf_range, price_to_index
+from .EventLog import EventLog
+from collections import Counter
 from datetime import datetime
 from time import time
 from typing import List
+import numpy as np
 import numbers
-import threading
 import logging
-import os
+import threading
 
 
 class OrderBook(object):
@@ -23,17 +26,39 @@ class OrderBook(object):
 
     Methods:
         init_book() -- Build the initial order book and volume segment tree.
+        set_levels() -- Rewrite the volumes at a set of price points.
+        mark_stale() -- Flag the book as out of sync with the exchange.
+        is_stale() -- Get whether the book is out of sync.
+        set_change_trigger() -- Signal an event on significant changes.
+        changed() -- Get whether the book changed significantly.
+        get_near_touch_depth() -- Get the bid and ask depth near the touch.
+        set_twap_ranges() -- Integrate the depth of percent ranges over time.
+        pop_twap() -- Get and reset the time weighted average depths.
         update_volume() -- Update the volume at a given price point.
         set_market_price() -- Set the current market price.
         get_volume_in_range() -- Get the sum of volume within a price range.
         get_total_volume() -- Get the total volume of the entire order book.
         get_market_price() -- Get the current market price.
+        get_price_cap() -- Get the price cap.
+        get_access_lock() -- Get the lock guarding updates and queries.
+        pop_rejections() -- Get and reset the rejected update counters.
     """
 
     # Static Variable
     __event_log = logging.getLogger(__name__)
 
-    def __init__(self, price_cap: float, currency: str):
+    def __init__(self, price_cap: float, currency: str, volume_tree=None):
+        """
+        Arguments:
+            price_cap -- A number. See price_cap above.
+            currency -- A string. A product id such as 'BTC-USD'.
+            volume_tree -- A mutable sequence of 2 * price_cap * 100 zeros,
+                           e.g. a memoryview slice of an array of doubles
+                           shared with other books (see MultiBook), or a
+                           NumPy array, to store the segment tree in. A new
+                           list is used by default.
+        """
+        EventLog.get_logger(__name__, 'OrderBook.log')
         if not isinstance(price_cap, numbers.Number):
             raise TypeError('Error: order book price_cap must be a number.\n')
 
@@ -43,33 +68,58 @@ class OrderBook(object):
         if not isinstance(currency, str):
             raise TypeError('Error: order book currency must be a string.\n')
 
-        currencies = ['BTC-USD', 'BCH-USD', 'ETH-USD', 'LTC-USD']
-        if currency not in currencies:
+        currencies = currency.split('-')
+        if len(currencies) != 2 or not all(currencies):
             raise ValueError('Error: {} is not an '.format(currency) +
-                             'accepted currency name. The name must be one ' +
-                             'of the following: {}'.format(currencies))
+                             'accepted currency name. The name must be a ' +
+                             'product id such as BTC-USD.')
+
+        if (volume_tree is not None and
+                len(volume_tree) != 2 * int(price_cap * 100)):
+            raise ValueError('Error: order book volume_tree must hold ' +
+                             '2 * price_cap * 100 values.\n')
 
         self.__access_lock = threading.Lock()
         self.__market_price = 0
         self.__price_cap = price_cap
         self.__price_points = int(price_cap * 100)
-        self.__volume_seg_tree = [0] * (2 * self.__price_points)
+        self.__volume_seg_tree = volume_tree
+        if volume_tree is None:
+            self.__volume_seg_tree = [0] * (2 * self.__price_points)
         self.__currency = currency
-
-        if self.__currency == 'BTC-USD':
-            # Needed to ensure logging environment is setup
-            # properly (and only once).
-            fmt = '%(asctime)s %(levelname)s ' + \
-                '%(name)s.%(funcName)s() %(message)s'
-            formatter = logging.Formatter(fmt=fmt)
-            handler = logging.FileHandler(
-                os.path.join('logs/', 'OrderBook.log'))
-            handler.setFormatter(formatter)
-            OrderBook.__event_log.setLevel(logging.DEBUG)
-            OrderBook.__event_log.addHandler(handler)
-            OrderBook.__event_log.debug("initialized " + self.__currency)
-        else:
-            self.__event_log.debug("initialized " + self.__currency)
+        self.__stale = False
+
+        # Leaf offsets of the percent ranges passed to query(), per range
+        # set, recomputed only when the market price moves.
+        self.__query_plans = {}
+        self.__total_bounds = self.__leaf_range(0.01, price_cap - 0.01)
+
+        # Bands of depth around market price kept up to date as updates
+        # are applied. Band i covers [price - i%, price] at index 2i and
+        # [price, price + i%] at index 2i + 1 of the bounds and sums.
+        self.__band_percents = []
+        self.__band_plan = None
+        self.__band_bounds = []
+        self.__band_sums = []
+
+        # Near touch band for event driven sampling
+        self.__change_event = None
+        self.__near_band = None
+        self.__depth_threshold = 0
+        self.__price_threshold = 0
+        self.__baseline = (0.0, 0.0, 0.0)
+        self.__changed = False
+
+        # Time weighted average depth of the sampled percent ranges
+        self.__twap_band = None
+        self.__twap_integrals = []
+        self.__twap_start = 0.0
+        self.__twap_last = 0.0
+
+        # Rejected updates are tallied rather than logged so that the
+        # update path never waits on the log file.
+        self.__rejections = Counter()
+        self.__event_log.debug('initialized %s', self.__currency)
 
     def init_book(self, orders: dict):
         """Builds the initial order book segment tree.
@@ -83,6 +133,133 @@ class OrderBook(object):
         with self.__access_lock:
             volumes = self.__gen_vol_array(orders['bids'], orders['asks'])
             self.__build_order_book(volumes)
+            self.__stale = False
+            self.__update_bands()
+            self.__restart_twap()
+
+    def set_levels(self, volumes: dict):
+        """Write the volume at each of a set of price points, recomputing
+        only their ancestors in the segment tree, then clear the stale
+        flag. The cost depends on the number of price points written
+        rather than on the size of the book.
+
+        Arguments:
+            volumes -- A dictionary. The new volume keyed by price index,
+                       price_to_index(price), under the price cap.
+        """
+        with self.__access_lock:
+            nodes = set()
+            for price_index, volume in volumes.items():
+                leaf_index = self.__price_points + price_index
+                self.__volume_seg_tree[leaf_index] = float(volume)
+                nodes.add(leaf_index >> 1)
+
+            # Recalculate the volume sums of every ancestor, one tree
+            # level at a time.
+            while nodes and nodes != {0}:
+                for i in nodes:
+                    self.__volume_seg_tree[i] = (
+                        self.__volume_seg_tree[i << 1] +
+                        self.__volume_seg_tree[i << 1 | 1])
+                nodes = {i >> 1 for i in nodes}
+
+            self.__stale = False
+            self.__update_bands()
+            self.__restart_twap()
+            self.__check_change()
+
+    def mark_stale(self):
+        """Flag the book as out of sync with the exchange, e.g. after a
+        missed update. The flag is cleared by the next snapshot. The
+        time the book is stale is left out of its TWAP."""
+        with self.__access_lock:
+            self.__integrate_twap()
+            self.__stale = True
+
+    def is_stale(self) -> bool:
+        """Return whether the book is out of sync with the exchange."""
+        return self.__stale
+
+    def set_change_trigger(self,
+                           event: threading.Event,
+                           near_percent: float,
+                           depth_threshold: float,
+                           price_threshold: float):
+        """Track the bid and ask depth within `near_percent` of market
+        price as updates are applied, and set `event` once the book has
+        changed significantly since the last query(), i.e. once either
+        near touch depth has moved by more than `depth_threshold` or the
+        market price by more than `price_threshold` (both fractions).
+
+        Arguments:
+            event -- A threading.Event. Set on a significant change.
+            near_percent -- A number. The near touch band, in percent.
+            depth_threshold -- A number. The relative depth change that is
+                               significant, e.g. 0.05 for 5%.
+            price_threshold -- A number. The relative price change that is
+                               significant, e.g. 0.0005 for 5 basis points.
+        """
+        with self.__access_lock:
+            self.__change_event = event
+            self.__near_band = self.__add_band(near_percent)
+            self.__depth_threshold = depth_threshold
+            self.__price_threshold = price_threshold
+            self.__update_bands()
+            self.__reset_change()
+
+    def changed(self) -> bool:
+        """Return whether the book changed significantly since the
+        last query()."""
+        return self.__changed
+
+    def get_near_touch_depth(self) -> tuple:
+        """Return the bid and ask depth within the near touch band."""
+        if self.__near_band is None:
+            return 0.0, 0.0
+        return tuple(self.__band_sums[2 * self.__near_band:
+                                      2 * self.__near_band + 2])
+
+    def set_twap_ranges(self, percent_ranges: List[float]):
+        """Start integrating the depth above and below market price within
+        each of the input percent ranges over time, as updates are applied,
+        so that pop_twap() can return their time weighted averages without
+        re-running the query.
+
+        Arguments:
+            percent_ranges -- A list of floats. The same percentage ranges
+                              that are passed to query().
+        """
+        with self.__access_lock:
+            self.__twap_band = len(self.__band_percents)
+            for percent in percent_ranges:
+                self.__add_band(percent)
+            self.__update_bands()
+            self.__twap_integrals = [0.0] * (2 * len(percent_ranges))
+            self.__twap_start = self.__twap_last = time()
+
+    def pop_twap(self) -> List[float]:
+        """Return the time weighted average buy volumes of every range
+        set with set_twap_ranges(), followed by the sell volumes, over the
+        interval since the last call, and start a new interval.
+        """
+        with self.__access_lock:
+            if self.__twap_band is None:
+                return []
+
+            now = time()
+            self.__integrate_twap(now)
+            duration = now - self.__twap_start
+            first = 2 * self.__twap_band
+            if duration > 0:
+                averages = [integral / duration
+                            for integral in self.__twap_integrals]
+            else:
+                averages = self.__band_sums[
+                    first:first + len(self.__twap_integrals)]
+
+            self.__twap_integrals = [0.0] * len(self.__twap_integrals)
+            self.__twap_start = now
+            return averages[0::2] + averages[1::2]
 
     def update_volume(self, price: float, volume: float):
         """Update the volume at the input price.n
@@ -95,9 +272,11 @@ class OrderBook(object):
         """
         with self.__access_lock:
             if self.__valid_order(price, volume):
-                price_index = self.__price_points + int(float(price) * 100) - 1
+                price_index = self.__price_points + price_to_index(price)
 
                 # Update volume at leaf of tree
+                leaf_index = price_index
+                change = float(volume) - self.__volume_seg_tree[price_index]
                 self.__volume_seg_tree[price_index] = float(volume)
 
                 # Updates volume sums of parent nodes
@@ -106,10 +285,12 @@ class OrderBook(object):
                         self.__volume_seg_tree[price_index] +
                         self.__volume_seg_tree[price_index ^ 1])
                     price_index >>= 1
+
+                if self.__band_percents:
+                    self.__integrate_twap()
+                    self.__track_change(leaf_index, change)
             else:
-                self.__event_log.warning(
-                    '{} volume not set, {} is not a valid price'.format(
-                        self.__currency, price))
+                self.__rejections['volume_updates'] += 1
 
     def update_market_price(self, price: float):
         """Set the current market price. Market price is used to
@@ -120,11 +301,15 @@ class OrderBook(object):
         """
         with self.__access_lock:
             if self.__valid_price(price):
+                moved = float(price) != self.__market_price
+                if self.__band_percents and moved:
+                    self.__integrate_twap()
                 self.__market_price = float(price)
+                if self.__band_percents and moved:
+                    self.__update_bands()
+                    self.__check_change()
             else:
-                self.__event_log.warning(
-                    '{} market price not set {} is not a valid price'.format(
-                        self.__currency, price))
+                self.__rejections['market_price_updates'] += 1
 
     def query(self, percent_ranges: List[float]) -> tuple:
         """Perform a batch query of volumes above and below market price
@@ -143,18 +328,21 @@ class OrderBook(object):
 
             row = [second_time, self.__currency, server_time,
                    price]
-            buy_vols = []
-            sell_vols = []
 
-            for percent in percent_ranges:
-                high = price + ((price * percent) / 100)
-                low = price - ((price * percent) / 100)
-                buy_vols.append(self.get_volume_in_range(low, price))
-                sell_vols.append(self.get_volume_in_range(price, high))
-
-            row.extend(buy_vols)
-            row.extend(sell_vols)
-            row.append(self.get_total_volume())
+            key = tuple(percent_ranges)
+            plan = self.__query_plans.get(key)
+            if plan is None:
+                plan = self.__query_plans[key] = QueryPlan(
+                    self.__price_cap, percent_ranges)
+            plan.update(price)
+            volumes = plan.evaluate(self.__sum_leaves)
+            if plan.invalid:
+                self.__rejections['volume_queries'] += plan.invalid
+
+            row.extend(volumes[0::2])
+            row.extend(volumes[1::2])
+            row.append(self.__sum_leaves(*self.__total_bounds))
+            self.__reset_change()
             return row
 
     def built(self) -> bool:
@@ -180,27 +368,11 @@ class OrderBook(object):
         volume_sum = 0
         if(self.__valid_price(lower_price_bound) and
            self.__valid_price(upper_price_bound)):
-
-            # Generate indices from input prices
-            left_index = int(float(lower_price_bound) * 100 -
-                             1 + self.__price_points)
-            right_index = int(float(upper_price_bound + 0.01) * 100 -
-                              1 + self.__price_points)
-
-            # Sum all volumes in [lower bound, upper bound)
-            while left_index < right_index:
-                if left_index & 1:
-                    volume_sum += self.__volume_seg_tree[left_index]
-                    left_index += 1
-                if right_index & 1:
-                    right_index -= 1
-                    volume_sum += self.__volume_seg_tree[right_index]
-                left_index >>= 1
-                right_index >>= 1
+            volume_sum = self.__sum_leaves(
+                *self.__leaf_range(float(lower_price_bound),
+                                   float(upper_price_bound)))
         else:
-            self.__event_log.warning(
-                '{} failed to query volume {} to {}'.format(
-                    self.__currency, upper_price_bound, lower_price_bound))
+            self.__rejections['volume_queries'] += 1
 
         return volume_sum
 
@@ -212,6 +384,125 @@ class OrderBook(object):
         """Return the current market price."""
         return self.__market_price
 
+    def get_price_cap(self) -> float:
+        """Return the price cap of the order book."""
+        return self.__price_cap
+
+    def get_access_lock(self) -> threading.Lock:
+        """Return the lock held while the book is updated or queried, so
+        that several books can be queried together consistently."""
+        return self.__access_lock
+
+    def pop_rejections(self) -> dict:
+        """Return the number of rejected updates, queries and invalid
+        values seen since the last call, keyed by reason, and reset the
+        counters.
+        """
+        with self.__access_lock:
+            rejections = dict(self.__rejections)
+            self.__rejections.clear()
+        return rejections
+
+    def __leaf_range(self, lower_price_bound: float,
+                     upper_price_bound: float) -> tuple:
+        """Return the leaf indices [left, right) of the segment tree that
+        hold the volumes of the prices in [lower bound, upper bound].
+        """
+        return leaf_range(self.__price_points, lower_price_bound,
+                          upper_price_bound)
+
+    def __sum_leaves(self, left_index: int, right_index: int) -> float:
+        """Return the sum of the leaves in [left index, right index)."""
+        volume_sum = 0
+        while left_index < right_index:
+            if left_index & 1:
+                volume_sum += self.__volume_seg_tree[left_index]
+                left_index += 1
+            if right_index & 1:
+                right_index -= 1
+                volume_sum += self.__volume_seg_tree[right_index]
+            left_index >>= 1
+            right_index >>= 1
+        return volume_sum
+
+    def __add_band(self, percent: float) -> int:
+        """Start tracking the depth within `percent` of market price and
+        return the index of the band. Must be called holding the access
+        lock, followed by __update_bands()."""
+        self.__band_percents.append(percent)
+        return len(self.__band_percents) - 1
+
+    def __update_bands(self):
+        """Recompute every band around the market price and the depth
+        inside it. Must be called holding the access lock."""
+        if (self.__band_plan is None or
+                self.__band_plan.percent_ranges != self.__band_percents):
+            self.__band_plan = QueryPlan(self.__price_cap,
+                                         self.__band_percents)
+        self.__band_plan.update(self.__market_price)
+        self.__band_bounds = self.__band_plan.bounds
+        self.__band_sums = self.__band_plan.evaluate(self.__sum_leaves)
+
+    def __track_change(self, leaf_index: int, change: float):
+        """Apply a volume change at a leaf to the depth of every band
+        containing it. Must be called holding the access lock."""
+        for i, (left_index, right_index) in enumerate(self.__band_bounds):
+            if left_index <= leaf_index < right_index:
+                self.__band_sums[i] += change
+        self.__check_change()
+
+    def __check_change(self):
+        """Set the change event the first time the near touch depth or
+        market price moves past its threshold since the last query().
+        Must be called holding the access lock."""
+        if self.__changed or self.__change_event is None:
+            return
+        bid, ask, price = self.__baseline
+        near_bid, near_ask = self.get_near_touch_depth()
+        if (abs(near_bid - bid) > self.__depth_threshold * bid or
+                abs(near_ask - ask) > self.__depth_threshold * ask or
+                abs(self.__market_price - price) >
+                self.__price_threshold * price):
+            self.__changed = True
+            self.__change_event.set()
+
+    def __integrate_twap(self, now: float = None):
+        """Add the depth of every TWAP band, multiplied by the time it
+        has held since the last call, to the band's integral. Time spent
+        stale is skipped, moving the start of the interval forward. Must
+        be called holding the access lock, before any band depth changes.
+        """
+        if self.__twap_band is None:
+            return
+        if now is None:
+            now = time()
+        elapsed = now - self.__twap_last
+        if elapsed > 0 and self.__stale:
+            self.__twap_start += elapsed
+        elif elapsed > 0:
+            first = 2 * self.__twap_band
+            depths = self.__band_sums[
+                first:first + len(self.__twap_integrals)]
+            for i, depth in enumerate(depths):
+                self.__twap_integrals[i] += depth * elapsed
+        self.__twap_last = now
+
+    def __restart_twap(self):
+        """Drop the TWAP integrals and start a new interval now, so that
+        the time before a book is (re)built is never averaged in. Must be
+        called holding the access lock, after the bands are updated."""
+        if self.__twap_band is None:
+            return
+        self.__twap_integrals = [0.0] * len(self.__twap_integrals)
+        self.__twap_start = self.__twap_last = time()
+
+    def __reset_change(self):
+        """Make the current state the baseline changes are measured
+        against. Must be called holding the access lock."""
+        near_bid, near_ask = self.get_near_touch_depth()
+        self.__baseline = (near_bid, near_ask, self.__market_price)
+        self.__changed = False
+
     def __build_order_book(self, volumes: List[float]):
         """Constructs the order book segment tree.
 
@@ -221,6 +512,22 @@ class OrderBook(object):
                       snap shot given by GDAX.
 
         """
+        tree = self.__volume_seg_tree
+        if isinstance(tree, memoryview):
+            tree = np.frombuffer(tree, dtype=float)
+        if isinstance(tree, np.ndarray):
+            # Fill the leaves, then every run of parents whose children
+            # are all past it, from the leaves up to the root.
+            tree[self.__price_points:] = volumes
+            right_index = self.__price_points
+            while right_index > 1:
+                left_index = (right_index + 1) >> 1
+                tree[left_index:right_index] = (
+                    tree[2 * left_index:2 * right_index:2] +
+                    tree[2 * left_index + 1:2 * right_index:2])
+                right_index = left_index
+            return
+
         # Initialize leaves of the segment tree with input volumes
         for i in range(0, self.__price_points):
             self.__volume_seg_tree[self.__price_points + i] = volumes[i]
@@ -258,12 +565,12 @@ class OrderBook(object):
         # the exhange order book that fall under price cap.
         for order in bid_orders:
             if self.__valid_order(order[0], order[1]):
-                price_index = int(float(order[0]) * 100) - 1
+                price_index = price_to_index(order[0])
                 volumes[price_index] = float(order[1])
 
         for order in ask_orders:
             if self.__valid_order(order[0], order[1]):
-                price_index = int(float(order[0]) * 100) - 1
+                price_index = price_to_index(order[0])
                 volumes[price_index] = float(order[1])
 
         return volumes
@@ -281,8 +588,8 @@ class OrderBook(object):
                 self.__valid_volume(volume))
 
     def __valid_price(self, price: float) -> bool:
-        """Return whether price is a valid number, is positive,
-        and is under the current price cap.
+        """Return whether price is a valid number, is at least a cent
+        once rounded, and is under the current price cap.
 
         Arguments:
             price -- Type unkown. The price being validated.
@@ -291,10 +598,8 @@ class OrderBook(object):
             return False
 
         price = float(price)
-        if price <= 0:
-            self.__event_log.warning(
-                '{} order book price ${} is not a valid price'.format(
-                    self.__currency, price))
+        if price_to_index(price) < 0:
+            self.__rejections['non_positive_price'] += 1
             return False
 
         return self.__price_under_cap(price)
@@ -307,9 +612,7 @@ class OrderBook(object):
             price -- Type unkown. The price being validated.
         """
         if price > self.__price_cap:
-            # self.__event_log.warning(
-            #     '{} order book price is above price cap {}'.format(
-            #         self.__currency, self.__price_cap))
+            self.__rejections['price_above_cap'] += 1
             return False
         return True
 
@@ -323,9 +626,7 @@ class OrderBook(object):
             return False
 
         if float(volume) < 0:
-            self.__event_log.warning(
-                '{} order book volume {} is negative'.format(
-                    self.__currency, volume))
+            self.__rejections['negative_volume'] += 1
             return False
 
         return True
@@ -341,8 +642,6 @@ class OrderBook(object):
             try:
                 number = float(number)
             except ValueError:
-                self.__event_log.warning(
-                    '{} expected a number for \'{}\' but found {}'.format(
-                        self.__currency, name, number))
+                self.__rejections['invalid_' + name] += 1
                 return False
         return True
@@ -0,0 +1,150 @@
+from .EventLog import EventLog
+from collections import Counter
+from datetime import datetime
+from time import sleep, time
+import threading
+import signal
+import sys
+import logging
+import os
+
+
+class Profiler(object):
+    """A sampling profiler that can be started in a running process, e.g.
+    by sending it SIGUSR1, without restarting it or pausing ingestion.
+
+    While running, a background thread takes a snapshot of every other
+    thread's stack (`sys._current_frames()`) every `interval` seconds. When
+    `duration` seconds have passed it writes, to `out_dir`:
+        profile-<time>.collapsed -- One line per distinct stack, in the
+                                    collapsed format read by flamegraph.pl
+                                    and speedscope, rooted at the thread
+                                    name.
+        profile-<time>.txt -- Per function totals: the share of thread
+                              stacks sampled on which the function was
+                              (total), and was at the top (self).
+
+    Attributes:
+        interval -- A number. The time between two samples, in seconds.
+        duration -- A number. How long a profile runs, in seconds.
+        out_dir -- A string. The directory profiles are written to.
+
+    Methods:
+        install() -- Start a profile whenever a signal is received.
+        start() -- Start a profile in the background.
+        is_running() -- Whether a profile is being taken.
+    """
+
+    # Static Variable
+    __event_log = logging.getLogger(__name__)
+
+    def __init__(self,
+                 interval: float = 0.01,
+                 duration: float = 30,
+                 out_dir: str = EventLog.LOG_DIR):
+        EventLog.get_logger(__name__, 'Profiler.log')
+        self.interval = interval
+        self.duration = duration
+        self.out_dir = out_dir
+        self.__lock = threading.Lock()
+        self.__thread = None
+
+    def install(self, signum: int = None) -> bool:
+        """Start a profile whenever the process receives `signum`, SIGUSR1
+        by default. Must be called from the main thread. Returns False if
+        the platform has no such signal.
+
+        Arguments:
+            signum -- An int. The signal number.
+        """
+        if signum is None:
+            signum = getattr(signal, 'SIGUSR1', None)
+            if signum is None:
+                return False
+        signal.signal(signum, lambda *args: self.start())
+        self.__event_log.info('profiling on signal %s, pid %s',
+                              signum, os.getpid())
+        return True
+
+    def start(self, duration: float = None) -> bool:
+        """Start a profile in a background thread, unless one is already
+        running. Returns whether a profile was started.
+
+        Arguments:
+            duration -- A number. How long to profile, defaults to
+                        `duration`.
+        """
+        with self.__lock:
+            if self.is_running():
+                return False
+            self.__thread = threading.Thread(
+                target=self.__profile, name='profiler', daemon=True,
+                args=(self.duration if duration is None else duration,))
+            self.__thread.start()
+        return True
+
+    def is_running(self) -> bool:
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def __profile(self, duration: float):
+        self.__event_log.info('profiling for %s seconds', duration)
+        stacks = Counter()
+        samples = 0
+        own_id = threading.get_ident()
+        deadline = time() + duration
+        while time() < deadline:
+            names = {thread.ident: thread.name
+                     for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self.__label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stacks[tuple(reversed(stack))] += 1
+            samples += 1
+            sleep(self.interval)
+
+        try:
+            path = self.__write(stacks, samples)
+            self.__event_log.info('%s samples written to %s', samples, path)
+        except OSError as error:
+            self.__event_log.error('could not write profile: %s', error)
+
+    @staticmethod
+    def __label(code) -> str:
+        return '{}:{}'.format(os.path.basename(code.co_filename),
+                              getattr(code, 'co_qualname', code.co_name))
+
+    def __write(self, stacks: Counter, samples: int) -> str:
+        """Write the collapsed stacks and per function totals of a profile
+        and return the path of the collapsed stacks."""
+        os.makedirs(self.out_dir, exist_ok=True)
+        name = 'profile-{}'.format(datetime.now().strftime('%Y%m%d-%H%M%S'))
+        path = os.path.join(self.out_dir, name + '.collapsed')
+        with open(path, 'w') as collapsed:
+            for stack, count in stacks.most_common():
+                collapsed.write('{} {}\n'.format(';'.join(stack), count))
+
+        # The first entry of every stack is the thread name.
+        totals = Counter()
+        own = Counter()
+        stack_count = max(sum(stacks.values()), 1)
+        for stack, count in stacks.items():
+            for function in set(stack[1:]):
+                totals[function] += count
+            if len(stack) > 1:
+                own[stack[-1]] += count
+
+        with open(os.path.join(self.out_dir, name + '.txt'), 'w') as summary:
+            summary.write('{} samples every {} seconds, {} stacks\n\n'.format(
+                samples, self.interval, stack_count))
+            summary.write('{:>8} {:>8}  {}\n'.format('total%', 'self%',
+                                                     'function'))
+            for function, count in totals.most_common():
+                summary.write('{:8.2f} {:8.2f}  {}\n'.format(
+                    100.0 * count / stack_count,
+                    100.0 * own[function] / stack_count, function))
+        return path
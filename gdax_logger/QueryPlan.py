@@ -0,0 +1,135 @@
+from typing import Callable, List
+
+
+def price_to_index(price) -> int:
+    """Return the index of a price among the price points of an order
+    book, int(price * 100) - 1. The price is rounded to the nearest cent
+    first, as binary floating point would put prices such as 4.35
+    (434.99999999999994 cents) at the cent below.
+
+    Arguments:
+        price -- A number, or a string such as '4.35'.
+    """
+    return int(round(float(price) * 100)) - 1
+
+
+def leaf_range(price_points: int, lower_price_bound: float,
+               upper_price_bound: float) -> tuple:
+    """Return the leaf indices [left, right) of an order book segment tree
+    with `price_points` leaves that hold the volumes of the prices in
+    [lower bound, upper bound], each rounded to the nearest cent.
+    """
+    left_index = price_points + price_to_index(lower_price_bound)
+    right_index = price_points + price_to_index(upper_price_bound) + 1
+    return left_index, right_index
+
+
+class QueryPlan(object):
+    """The segment tree leaf offsets of a set of percent ranges around the
+    market price of one order book, computed once per market price.
+
+    Every bid range ends at the market price and every ask range starts
+    at it, so the ranges of each side are nested. The plan splits them
+    into disjoint segments, ordered from the market price outwards, and
+    evaluate() sums each segment once, adding it to a running total. The
+    whole set of ranges is then summed in a single pass over the tree,
+    with integer indices only.
+
+    Attributes:
+        percent_ranges -- A list of floats. The percentage ranges, above
+                          and below market price, the plan covers.
+        bounds -- A list of tuples. The leaf range [left, right) of the bid
+                  side of range i at index 2i, and of its ask side at 2i+1.
+                  Invalid ranges, those with a bound that is not a valid
+                  price, are (0, 0).
+        invalid -- An int. The number of invalid ranges, which sum to zero.
+
+    Methods:
+        update() -- Recompute the offsets if the market price moved.
+        evaluate() -- Sum the volume in every range.
+    """
+
+    def __init__(self, price_cap: float, percent_ranges: List[float]):
+        """
+        Arguments:
+            price_cap -- A number. The price cap of the order book.
+            percent_ranges -- A list of floats. See percent_ranges above.
+        """
+        self.percent_ranges = list(percent_ranges)
+        self.bounds = [(0, 0)] * (2 * len(self.percent_ranges))
+        self.invalid = len(self.bounds)
+        self.__price_cap = price_cap
+        self.__price_points = int(price_cap * 100)
+        self.__price = None
+        self.__steps = ([], [])
+
+        # Ranges from the narrowest to the widest, i.e. the order in which
+        # the nested ranges of each side extend away from market price.
+        self.__widening = sorted(range(len(self.percent_ranges)),
+                                 key=lambda i: self.percent_ranges[i])
+
+    def update(self, price: float) -> bool:
+        """Recompute the leaf offsets of every range around the input
+        market price, unless it is the price they were computed for.
+        Returns whether they were recomputed.
+
+        Arguments:
+            price -- A number. The market price.
+        """
+        if price == self.__price:
+            return False
+        self.__price = price
+
+        self.bounds = []
+        self.invalid = 0
+        for percent in self.percent_ranges:
+            offset = (price * percent) / 100
+            for low, high in ((price - offset, price),
+                              (price, price + offset)):
+                left_index, right_index = leaf_range(self.__price_points,
+                                                     low, high)
+                if low <= 0 or high > self.__price_cap:
+                    left_index = right_index = 0
+                    self.invalid += 1
+                self.bounds.append((left_index, right_index))
+
+        # Bid ranges share their right end and ask ranges their left end.
+        # Walk each side outwards from the market price, summing only the
+        # leaves a range adds to the narrower one before it.
+        bid_steps = []
+        ask_steps = []
+        bid_edge = ask_edge = None
+        for range_index in self.__widening:
+            index = 2 * range_index
+            left_index, right_index = self.bounds[index]
+            if left_index < right_index:
+                if bid_edge is None:
+                    bid_edge = right_index
+                bid_steps.append((index, left_index, bid_edge))
+                bid_edge = left_index
+
+            left_index, right_index = self.bounds[index + 1]
+            if left_index < right_index:
+                if ask_edge is None:
+                    ask_edge = left_index
+                ask_steps.append((index + 1, ask_edge, right_index))
+                ask_edge = right_index
+
+        self.__steps = (bid_steps, ask_steps)
+        return True
+
+    def evaluate(self, sum_leaves: Callable[[int, int], float]) -> List[float]:
+        """Return the volume in every range, in the layout of `bounds`.
+
+        Arguments:
+            sum_leaves -- A callable. Returns the sum of the leaves in
+                          [left, right) of the book's segment tree.
+        """
+        sums = [0.0] * len(self.bounds)
+        for steps in self.__steps:
+            volume = 0.0
+            for index, left_index, right_index in steps:
+                if left_index < right_index:
+                    volume += sum_leaves(left_index, right_index)
+                sums[index] = volume
+        return sums
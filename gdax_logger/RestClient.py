@@ -0,0 +1,168 @@
+from .GDAXConstants import GDAXConst
+from .EventLog import EventLog
+from requests.adapters import HTTPAdapter
+from time import sleep, monotonic
+import threading
+import logging
+import requests
+
+
+class RestClient(object):
+    """A thin client for the public GDAX REST API built on a pooled
+    `requests.Session`, so that repeated requests reuse open connections.
+
+    Attributes:
+        rest_url -- A string. The base url of the REST API, defaults to the
+                    live exchange. Can point at a local stand-in server.
+        timeout -- A number. The request timeout, in seconds.
+        retries -- An int. How many times a rate limited (429) or failed
+                   request is retried before giving up.
+        rate_limit -- A number. The most requests per second sent by all
+                      threads sharing the client, unlimited if None.
+
+    Methods:
+        get() -- Perform a GET request and return the decoded JSON.
+        get_order_book() -- Get a snapshot of a product's order book.
+        get_trades() -- Get a page of a product's trade history.
+        get_candles() -- Get a product's candles within a time window.
+        close() -- Close every pooled connection.
+    """
+
+    # Static Variable
+    __event_log = logging.getLogger(__name__)
+
+    def __init__(self,
+                 rest_url: str = GDAXConst.Live.rest_url,
+                 pool_size: int = 4,
+                 timeout: float = 10,
+                 retries: int = 3,
+                 rate_limit: float = None):
+        EventLog.get_logger(__name__, 'RestClient.log')
+        self.rest_url = rest_url.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.rate_limit = rate_limit
+        self.__rate_lock = threading.Lock()
+        self.__next_request = 0.0
+
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.__session = requests.Session()
+        self.__session.mount('http://', adapter)
+        self.__session.mount('https://', adapter)
+        self.__session.headers[GDAXConst.content_type] = \
+            GDAXConst.application_json
+
+    def get(self, path: str, params: dict = None):
+        """Return the decoded JSON body of a GET request, or None if the
+        request failed. Rate limited requests are retried after the delay
+        given in the `Retry-After` header, or an exponential backoff.
+
+        Arguments:
+            path -- A string. The request path, e.g. '/products'.
+            params -- A dictionary. The query string parameters.
+        """
+        response = self.__request(path, params)
+        return None if response is None else response.json()
+
+    def get_order_book(self, product_id: str, level: int = 2) -> dict:
+        """Return a snapshot of a product's order book, containing its
+        `sequence`, `bids` and `asks`, or None if the request failed.
+
+        Arguments:
+            product_id -- A string. The product, e.g. 'BTC-USD'.
+            level -- An int. 2 for the top 50 aggregated levels per side,
+                     3 for every open order.
+        """
+        return self.get('/{}/{}/{}'.format(GDAXConst.products, product_id,
+                                           GDAXConst.book),
+                        params={'level': level})
+
+    def get_trades(self, product_id: str, after: str = None,
+                   limit: int = 100) -> tuple:
+        """Return a page of a product's trades, newest first, along with
+        the cursor of the next (older) page, or (None, None) if the request
+        failed. The cursor is None once the oldest trade has been returned.
+
+        Arguments:
+            product_id -- A string. The product, e.g. 'BTC-USD'.
+            after -- A string. The cursor returned with the previous page,
+                     None for the newest trades.
+            limit -- An int. The number of trades per page, at most 100.
+        """
+        params = {'limit': limit}
+        if after is not None:
+            params['after'] = after
+        response = self.__request('/{}/{}/{}'.format(
+            GDAXConst.products, product_id, GDAXConst.trades), params)
+        if response is None:
+            return None, None
+        trades = response.json()
+        if not trades:
+            return trades, None
+        return trades, response.headers.get('CB-AFTER')
+
+    def get_candles(self, product_id: str, start: str, end: str,
+                    granularity: int = 60) -> list:
+        """Return a product's candles within a time window, newest first,
+        as [time, low, high, open, close, volume] lists, or None if the
+        request failed. At most 300 candles are returned per request.
+
+        Arguments:
+            product_id -- A string. The product, e.g. 'BTC-USD'.
+            start -- A string. The ISO 8601 start of the window.
+            end -- A string. The ISO 8601 end of the window.
+            granularity -- An int. The candle length in seconds, one of
+                           60, 300, 900, 3600, 21600 or 86400.
+        """
+        return self.get('/{}/{}/{}'.format(GDAXConst.products, product_id,
+                                           GDAXConst.candles),
+                        params={'start': start, 'end': end,
+                                'granularity': granularity})
+
+    def close(self):
+        self.__session.close()
+
+    def __throttle(self):
+        """Wait for the next request slot so that all threads together
+        stay under `rate_limit` requests per second."""
+        if not self.rate_limit:
+            return
+        with self.__rate_lock:
+            now = monotonic()
+            slot = max(now, self.__next_request)
+            self.__next_request = slot + 1.0 / self.rate_limit
+        if slot > now:
+            sleep(slot - now)
+
+    def __request(self, path: str, params: dict = None):
+        """Return the response of a successful GET request, or None.
+        See get()."""
+        url = self.rest_url + path
+        for attempt in range(self.retries + 1):
+            self.__throttle()
+            try:
+                response = self.__session.get(
+                    url, params=params, timeout=self.timeout)
+            except requests.RequestException as error:
+                self.__event_log.warning('GET %s failed: %s', url, error)
+                sleep(2 ** attempt)
+                continue
+
+            if response.status_code == GDAXConst.Status.success:
+                return response
+
+            if response.status_code == GDAXConst.Status.too_many_requests:
+                delay = response.headers.get('Retry-After')
+                sleep(float(delay) if delay else 2 ** attempt)
+                continue
+
+            self.__event_log.warning('GET %s returned %s: %s', url,
+                                     response.status_code, response.text)
+            if response.status_code < GDAXConst.Status.internal_server_error:
+                return None
+            sleep(2 ** attempt)
+
+        self.__event_log.error('GET %s gave up after %s attempts',
+                               url, self.retries + 1)
+        return None
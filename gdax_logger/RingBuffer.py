@@ -0,0 +1,176 @@
+from typing import List
+import numpy as np
+import struct
+import mmap
+import os
+
+
+# The header of a ring file: magic, version, record size in bytes,
+# capacity in records, number of fields and the write cursor (the number
+# of records ever written), followed by the null separated field names.
+# Records start at HEADER_SIZE, so that they are page aligned.
+HEADER = struct.Struct('<8sIIQQQ')
+CURSOR = struct.Struct('<Q')
+CURSOR_OFFSET = HEADER.size - CURSOR.size
+HEADER_SIZE = 4096
+MAGIC = b'GDAXRING'
+VERSION = 1
+
+
+class RingBuffer(object):
+    """A fixed size, memory mapped file holding the most recent `capacity`
+    records of a product, each a packed row of float64 fields, such as
+    the sampled depth rows of one order book.
+
+    Records are packed straight into the mapped file with
+    struct.pack_into(), without an intermediate copy, and the cursor in the
+    header is advanced once a record is complete. An existing file with
+    the same layout is appended to, so a restart keeps its history. Other
+    processes read the file with RingReader.
+
+    Attributes:
+        path -- A string. The ring file.
+        fields -- A list of strings. The name of every field of a record.
+        capacity -- An int. The number of records kept.
+
+    Methods:
+        append() -- Write a record, overwriting the oldest once full.
+        close() -- Flush and unmap the file.
+    """
+
+    def __init__(self, path: str, fields: List[str], capacity: int = 100000):
+        self.path = path
+        self.fields = list(fields)
+        self.capacity = capacity
+        self.__record = struct.Struct('<{}d'.format(len(self.fields)))
+
+        names = '\0'.join(self.fields).encode()
+        if HEADER.size + len(names) > HEADER_SIZE:
+            raise ValueError('too many fields for a ring header')
+        size = HEADER_SIZE + capacity * self.__record.size
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        cursor = self.__existing_cursor(size)
+        with open(path, 'a+b') as ring_file:
+            ring_file.truncate(size)
+            self.__map = mmap.mmap(ring_file.fileno(), size)
+
+        if cursor is None:
+            cursor = 0
+            HEADER.pack_into(self.__map, 0, MAGIC, VERSION,
+                             self.__record.size, capacity, len(self.fields),
+                             cursor)
+            self.__map[HEADER.size:HEADER.size + len(names)] = names
+        self.__cursor = cursor
+
+    def append(self, values: List[float]):
+        """Write a record at the cursor and advance it.
+
+        Arguments:
+            values -- A list of numbers. One value per field.
+        """
+        offset = (HEADER_SIZE +
+                  (self.__cursor % self.capacity) * self.__record.size)
+        self.__record.pack_into(self.__map, offset, *values)
+        self.__cursor += 1
+        CURSOR.pack_into(self.__map, CURSOR_OFFSET, self.__cursor)
+
+    def close(self):
+        self.__map.flush()
+        self.__map.close()
+
+    def __existing_cursor(self, size: int) -> int:
+        """Return the cursor of an existing ring file with the same
+        layout, or None if there is none and the file has to be reset."""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) != size:
+            return None
+        reader = RingReader(self.path)
+        try:
+            if (reader.fields != self.fields or
+                    reader.capacity != self.capacity):
+                return None
+            return reader.cursor()
+        finally:
+            reader.close()
+
+
+class RingReader(object):
+    """Maps a ring file written by RingBuffer read only, and views its
+    records as a NumPy structured array without copying them.
+
+    Attributes:
+        path -- A string. The ring file.
+        fields -- A list of strings. The name of every field of a record.
+        capacity -- An int. The number of records the ring holds.
+        dtype -- A NumPy dtype. One float64 per field.
+
+    Methods:
+        cursor() -- Get the number of records ever written.
+        view() -- Get every slot of the ring, in storage order.
+        latest() -- Get the most recent records, oldest first.
+        close() -- Unmap the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as ring_file:
+            self.__map = mmap.mmap(ring_file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+
+        magic, version, record_size, capacity, field_count, _ = \
+            HEADER.unpack_from(self.__map)
+        if magic != MAGIC or version != VERSION:
+            self.__map.close()
+            raise ValueError('{} is not a ring file'.format(path))
+
+        names = self.__map[HEADER.size:HEADER_SIZE].rstrip(b'\0')
+        self.fields = names.decode().split('\0')[:field_count]
+        self.capacity = capacity
+        self.dtype = np.dtype([(name, '<f8') for name in self.fields])
+        if self.dtype.itemsize != record_size:
+            self.__map.close()
+            raise ValueError('{} has an unexpected record size'.format(path))
+
+    def cursor(self) -> int:
+        """Return the number of records ever written to the ring."""
+        return CURSOR.unpack_from(self.__map, CURSOR_OFFSET)[0]
+
+    def view(self) -> np.ndarray:
+        """Return every slot of the ring as a read only structured array
+        backed by the mapped file, in storage order. Slot
+        cursor() % capacity is the next to be written."""
+        return np.frombuffer(self.__map, dtype=self.dtype,
+                             count=self.capacity, offset=HEADER_SIZE)
+
+    def latest(self, count: int = None) -> np.ndarray:
+        """Return a copy of the most recent records, oldest first. The
+        slot being written next is left out, as the writer may be part
+        way through it.
+
+        The writer does not wait for readers, so the cursor is read again
+        once the records are copied, and the oldest records whose slots
+        were rewritten in the meantime are dropped, as in a seqlock. Fewer
+        than `count` records may be returned when the writer laps it.
+
+        Arguments:
+            count -- An int. The number of records, all of them by default.
+        """
+        cursor = self.cursor()
+        available = min(cursor, self.capacity - 1)
+        if count is None or count > available:
+            count = available
+        first = cursor - count
+        slots = (np.arange(first, cursor) % self.capacity)
+        records = self.view()[slots]
+
+        # Record i is overwritten by record i + capacity, and the record
+        # at the new cursor may be part way through being written.
+        overwritten = self.cursor() - self.capacity + 1 - first
+        if overwritten > 0:
+            records = records[overwritten:]
+        return records
+
+    def close(self):
+        self.__map.close()
@@ -0,0 +1,26 @@
+from datetime import datetime
+import calendar
+
+
+def parse_time(value: str) -> datetime:
+    """Return the naive UTC datetime of a GDAX timestamp, with or without
+    fractional seconds, e.g. '2018-01-01T00:00:00.123Z'.
+
+    Arguments:
+        value -- A string. The timestamp.
+    """
+    value = value.rstrip('Z').replace(' ', 'T')
+    if '+' in value:
+        value = value[:value.index('+')]
+    for time_format in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S',
+                        '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, time_format)
+        except ValueError:
+            continue
+    raise ValueError('unrecognized time: {}'.format(value))
+
+
+def to_epoch(moment: datetime) -> float:
+    """Return the epoch seconds of a naive UTC datetime."""
+    return calendar.timegm(moment.utctimetuple()) + moment.microsecond / 1e6
@@ -2,61 +2,239 @@
 """ A script that retrieves ticker and orderbook data from the GDAX Exchange.
 """
 from gdax_logger.LoggerHandler import LoggerHandler
+from gdax_logger.FeedMerger import FeedMerger
+from gdax_logger.Profiler import Profiler
+from gdax_logger.EventLog import EventLog
 from websocket._exceptions import *
 from websocket import WebSocketApp
 from gdax_logger import GDAXConst
+from time import sleep
 from time import time
+import threading
 import websocket
-import logging
+import argparse
 import errno
 import json
 import os
 
+PRODUCT_IDS = [
+    GDAXConst.btc_usd,
+    GDAXConst.eth_usd,
+    GDAXConst.ltc_usd,
+    GDAXConst.bch_usd
+]
+CHANNELS = [
+    GDAXConst.ticker,
+    GDAXConst.matches,
+    GDAXConst.level2
+]
+
+# Products fed by the full channel instead of level2 and matches.
+full_products = []
+
+# Live websockets by connection id, used to request resnapshots.
+connections = {}
+
+
+def subscription(product_ids, channels, request_type=GDAXConst.subscribe):
+    """ Returns a subscribe (or unsubscribe) request for GDAX."""
+    return json.dumps({
+        GDAXConst.request_type: request_type,
+        GDAXConst.product_ids: product_ids,
+        GDAXConst.channels: channels
+    })
+
 
 def on_open(ws):
     """ Sends the initial request to GDAX."""
-    request = json.dumps({
-        GDAXConst.request_type: GDAXConst.subscribe,
-        GDAXConst.product_ids: [
-            GDAXConst.btc_usd,
-            GDAXConst.eth_usd,
-            GDAXConst.ltc_usd,
-            GDAXConst.bch_usd
-        ],
-        GDAXConst.channels: [
-            GDAXConst.ticker,
-            GDAXConst.matches,
-            GDAXConst.level2
-        ]
-    })
+    if full_products:
+        level2_products = [p for p in PRODUCT_IDS if p not in full_products]
+        channels = [{'name': GDAXConst.ticker,
+                     GDAXConst.product_ids: PRODUCT_IDS},
+                    {'name': GDAXConst.full,
+                     GDAXConst.product_ids: full_products}]
+        if level2_products:
+            channels.extend(
+                {'name': channel, GDAXConst.product_ids: level2_products}
+                for channel in (GDAXConst.matches, GDAXConst.level2))
+        request = subscription(PRODUCT_IDS, channels)
+    else:
+        request = subscription(PRODUCT_IDS, CHANNELS)
     ws.send(request)
-    event_log.debug('request sent:\n{0}'.format(request))
+    event_log.debug('request sent:\n%s', request)
 
 
 def on_close(ws, *args):
-    event_log.info('websocket closed @ {}'.format(time()))
-    event_log.info('stopping...{}'.format('\n' * 5))
+    event_log.info('websocket closed @ %s', time())
+    event_log.info('stopping...%s', '\n' * 5)
 
 
 def on_message(ws, data):
+    dispatch(data)
+
+
+def dispatch(data):
     if GDAXConst.ticker in data:
         if 'time' in data:
             handler.insert_ticker(data)
         else:
-            event_log.warning('received update with no timestamp')
+            event_log.warning('received update with no timestamp',
+                              extra={'rate_key': 'no_timestamp'})
     else:
         handler.update_order_book(data)
 
 
 def on_error(ws, error):
     if isinstance(error, (KeyboardInterrupt)):
-        event_log.warning('interrupt @ {}'.format(time()))
+        event_log.warning('interrupt @ %s', time())
         handler.close()
     else:
-        event_log.exception('{} @ {}'.format(error, time()))
+        event_log.exception('%s @ %s', error, time())
+
+
+def on_gap(product_id, first_sequence, last_sequence):
+    """ Requests a fresh snapshot of a level2 product after the merged
+    feed missed messages. Products on the full channel are resynced over
+    REST by the handler itself."""
+    if product_id in full_products:
+        return
+    if resnapshot(product_id):
+        event_log.warning('%s resnapshot requested after gap %s to %s',
+                          product_id, first_sequence, last_sequence)
+
+
+def resnapshot(product_id):
+    """ Resubscribes to a product's level2 channel on one live connection,
+    which makes GDAX send a fresh snapshot of its order book. Returns
+    whether a connection took the request."""
+    for ws in list(connections.values()):
+        try:
+            ws.send(subscription([product_id], [GDAXConst.level2],
+                                 GDAXConst.unsubscribe))
+            ws.send(subscription([product_id], [GDAXConst.level2]))
+            return True
+        except WebSocketException as error:
+            event_log.exception('%s @ %s', error, time())
+    return False
+
+
+def run_connection(url, connection_id=None, merger=None):
+    """ Keeps one websocket connected until the handler is closed. When a
+    merger is given, messages are pushed through it instead of being
+    dispatched directly."""
+    def on_single_open(ws):
+        connections[connection_id] = ws
+        on_open(ws)
+
+    def on_single_close(ws, *args):
+        connections.pop(connection_id, None)
+        on_close(ws, *args)
+
+    def on_merged_open(ws):
+        merger.connected(connection_id)
+        connections[connection_id] = ws
+        on_open(ws)
+
+    def on_merged_close(ws, *args):
+        connections.pop(connection_id, None)
+        merger.disconnected(connection_id)
+        on_close(ws, *args)
+
+    def on_merged_message(ws, data):
+        merger.push(connection_id, data)
+
+    while handler.is_running():
+        try:
+            websocket.enableTrace(False)
+            if merger is None:
+                gdax_ws = WebSocketApp(
+                    url,
+                    on_open=on_single_open,
+                    on_close=on_single_close,
+                    on_error=on_error
+                )
+            else:
+                gdax_ws = WebSocketApp(
+                    url,
+                    on_open=on_merged_open,
+                    on_close=on_merged_close,
+                    on_error=on_error
+                )
+            if gdax_ws is not None:
+                if merger is None:
+                    gdax_ws.on_message = on_message
+                else:
+                    gdax_ws.on_message = on_merged_message
+                gdax_ws.run_forever(ping_interval=15)
+            else:
+                event_log.warning('unable to init websocket')
+
+        except WebSocketException as error:
+            event_log.exception('%s @ %s', error, time())
+        except Exception as error:
+            event_log.exception('%s @ %s', error, time())
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--url', default=GDAXConst.Live.websocket_url,
+        help='websocket feed url (default: %(default)s)')
+    parser.add_argument(
+        '--rest-url', default=GDAXConst.Live.rest_url,
+        help='REST api url order books are resynced from '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--full', nargs='+', default=[], choices=PRODUCT_IDS,
+        metavar='PRODUCT',
+        help='products to follow order by order on the full channel '
+             'instead of level2')
+    parser.add_argument(
+        '--publish', metavar='ADDRESS',
+        help='publish depth rows and tickers to local subscribers on a '
+             'unix socket path or localhost:port')
+    parser.add_argument(
+        '--event-sampling', action='store_true',
+        help='write a depth row when a book changes significantly '
+             'instead of about once per second')
+    parser.add_argument(
+        '--min-interval', type=float, default=0.1,
+        help='least seconds between two rows of a product when event '
+             'sampling (default: %(default)s)')
+    parser.add_argument(
+        '--max-interval', type=float, default=5.0,
+        help='most seconds between two rows of a product when event '
+             'sampling (default: %(default)s)')
+    parser.add_argument(
+        '--depth-threshold', type=float, default=0.05,
+        help='relative change in depth within 0.1%% of market price that '
+             'triggers a row (default: %(default)s)')
+    parser.add_argument(
+        '--price-threshold', type=float, default=0.0005,
+        help='relative change in market price that triggers a row '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--connections', type=int, default=1,
+        help='number of redundant feed connections merged on sequence '
+             'number (default: %(default)s)')
+    parser.add_argument(
+        '--detect-gaps', action='store_true',
+        help='hold and resnapshot on sequence gaps missed by every '
+             'connection, only use with contiguous (full) channels')
+    parser.add_argument(
+        '--profile-seconds', type=float, default=30,
+        help='how long a profile started with SIGUSR1 runs, stacks are '
+             'written to logs/ (default: %(default)s)')
+    parser.add_argument(
+        '--ring-dir', metavar='DIRECTORY',
+        help='also keep the latest depth rows of each product in a memory '
+             'mapped ring file in this directory')
+    parser.add_argument(
+        '--ring-capacity', type=int, default=100000,
+        help='depth rows kept per ring file (default: %(default)s)')
+    args = parser.parse_args()
+    full_products.extend(args.full)
+
     if not os.path.exists('logs'):
         try:
             os.makedirs('logs')
@@ -64,32 +242,37 @@ if __name__ == '__main__':
             if e.errno != errno.EEXIST:
                 raise
 
-    fmt = '%(asctime)s %(levelname)s %(name)s.%(funcName)s() %(message)s'
-    formatter = logging.Formatter(fmt=fmt)
-    handler = logging.FileHandler(os.path.join('logs/', 'main.log'))
-    handler.setFormatter(formatter)
-    event_log = logging.getLogger(__name__)
-    event_log.setLevel(logging.DEBUG)
-    event_log.addHandler(handler)
+    event_log = EventLog.get_logger(__name__, 'main.log')
     event_log.debug('started')
+    Profiler(duration=args.profile_seconds).install()
 
-    with LoggerHandler() as handler:
-        while handler.is_running():
+    with LoggerHandler(rest_url=args.rest_url,
+                       full_products=full_products,
+                       publish_address=args.publish,
+                       event_sampling=args.event_sampling,
+                       min_interval=args.min_interval,
+                       max_interval=args.max_interval,
+                       depth_threshold=args.depth_threshold,
+                       price_threshold=args.price_threshold,
+                       ring_dir=args.ring_dir,
+                       ring_capacity=args.ring_capacity,
+                       on_resnapshot=resnapshot) as handler:
+        if args.connections > 1:
+            merger = FeedMerger(dispatch, on_gap,
+                                detect_gaps=args.detect_gaps or
+                                set(full_products))
+            for connection_id in range(args.connections):
+                threading.Thread(
+                    target=run_connection,
+                    args=(args.url, connection_id, merger),
+                    name='connection-{}'.format(connection_id),
+                    daemon=True).start()
             try:
-                websocket.enableTrace(False)
-                gdax_ws = WebSocketApp(
-                    GDAXConst.Live.websocket_url,
-                    on_open=on_open,
-                    on_close=on_close,
-                    on_error=on_error
-                )
-                if gdax_ws is not None:
-                    gdax_ws.on_message = on_message
-                    gdax_ws.run_forever(ping_interval=15)
-                else:
-                    event_log.warning('unable to init websocket')
-
-            except WebSocketException as error:
-                event_log.exception('{} @ {}'.format(error, time()))
-            except Exception as error:
-                event_log.exception('{} @ {}'.format(error, time()))
+                while handler.is_running():
+                    sleep(1)
+            except KeyboardInterrupt:
+                event_log.warning('interrupt @ %s', time())
+            merger.close()
+            event_log.info('merged feed stats: %s', merger.get_stats())
+        else:
+            run_connection(args.url)
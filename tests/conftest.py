@@ -0,0 +1,5 @@
+""" Keeps the logs of the code under test out of the working tree."""
+from gdax_logger.EventLog import EventLog
+import tempfile
+
+EventLog.LOG_DIR = tempfile.mkdtemp(prefix='gdax_logger-logs-')
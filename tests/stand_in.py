@@ -0,0 +1,188 @@
+""" Local stand-ins for the GDAX websocket feed and REST api, used to test
+the logger against connections that drop and delay messages and against
+requests that fail.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from base64 import b64encode
+from hashlib import sha1
+from time import sleep
+import threading
+import random
+import socket
+import struct
+
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def lossy_script(messages, drop=None, max_delay=0.0, seed=0):
+    """ Returns the (delay, message) script of one connection, leaving out
+    the messages whose index is in `drop` and sleeping up to `max_delay`
+    seconds before some messages."""
+    rng = random.Random(seed)
+    drop = drop or set()
+    script = []
+    for i, message in enumerate(messages):
+        if i in drop:
+            continue
+        delay = rng.uniform(0, max_delay) if rng.random() < 0.05 else 0.0
+        script.append((delay, message))
+    return script
+
+
+class StandInServer(object):
+    """A minimal websocket server on localhost. The n-th connection to be
+    accepted waits for its subscribe request, and for every other script's
+    connection to subscribe, then plays the n-th script:
+    a list of (seconds to sleep, raw message) pairs. Connections are kept
+    open once their script is played, until the server is closed.
+
+    Attributes:
+        url -- A string. The websocket url of the server.
+    """
+
+    def __init__(self, scripts):
+        self.__scripts = list(scripts)
+        self.__closed = threading.Event()
+        self.__connections = []
+        self.__subscribed = threading.Barrier(len(self.__scripts))
+        self.__server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__server.bind(('127.0.0.1', 0))
+        self.__server.listen()
+        self.url = 'ws://127.0.0.1:{}'.format(self.__server.getsockname()[1])
+        self.__thread = threading.Thread(target=self.__accept, daemon=True)
+
+    def __enter__(self):
+        self.__thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.__closed.set()
+        self.__subscribed.abort()
+        self.__server.close()
+        for connection in self.__connections:
+            connection.close()
+
+    def __accept(self):
+        for script in self.__scripts:
+            try:
+                connection, _ = self.__server.accept()
+            except OSError:
+                return
+            self.__connections.append(connection)
+            threading.Thread(target=self.__play, args=(connection, script),
+                             daemon=True).start()
+
+    def __play(self, connection, script):
+        try:
+            self.__handshake(connection)
+            self.__read_frame(connection)
+            self.__subscribed.wait()
+            for delay, message in script:
+                if self.__closed.is_set():
+                    return
+                if delay:
+                    sleep(delay)
+                self.__send_frame(connection, message)
+            self.__closed.wait()
+        except (OSError, threading.BrokenBarrierError):
+            return
+
+    @staticmethod
+    def __handshake(connection):
+        request = b''
+        while b'\r\n\r\n' not in request:
+            chunk = connection.recv(4096)
+            if not chunk:
+                raise OSError('closed during handshake')
+            request += chunk
+        key = b''
+        for line in request.split(b'\r\n'):
+            if line.lower().startswith(b'sec-websocket-key:'):
+                key = line.split(b':', 1)[1].strip()
+        accept = b64encode(sha1(key + WEBSOCKET_GUID).digest())
+        connection.sendall(b'HTTP/1.1 101 Switching Protocols\r\n'
+                           b'Upgrade: websocket\r\n'
+                           b'Connection: Upgrade\r\n'
+                           b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+
+    @staticmethod
+    def __read_exactly(connection, size):
+        data = b''
+        while len(data) < size:
+            chunk = connection.recv(size - len(data))
+            if not chunk:
+                raise OSError('closed')
+            data += chunk
+        return data
+
+    def __read_frame(self, connection):
+        """ Reads one masked client frame and returns its payload."""
+        _, length = self.__read_exactly(connection, 2)
+        length &= 0x7f
+        if length == 126:
+            length, = struct.unpack('>H', self.__read_exactly(connection, 2))
+        elif length == 127:
+            length, = struct.unpack('>Q', self.__read_exactly(connection, 8))
+        mask = self.__read_exactly(connection, 4)
+        payload = self.__read_exactly(connection, length)
+        return bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+    @staticmethod
+    def __send_frame(connection, message):
+        payload = message.encode()
+        if len(payload) < 126:
+            header = struct.pack('>BB', 0x81, len(payload))
+        elif len(payload) < 1 << 16:
+            header = struct.pack('>BBH', 0x81, 126, len(payload))
+        else:
+            header = struct.pack('>BBQ', 0x81, 127, len(payload))
+        connection.sendall(header + payload)
+
+
+class RestStandIn(object):
+    """A minimal HTTP server on localhost. Every GET request is passed to
+    `respond`, with its path and query string parameters, which returns a
+    (status, headers, body) tuple. Requests are recorded in `requests`.
+
+    Attributes:
+        url -- A string. The base url of the server.
+        requests -- A list. The (path, params) of every request received.
+    """
+
+    def __init__(self, respond):
+        self.requests = []
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {key: values[-1] for key, values
+                          in parse_qs(url.query).items()}
+                stand_in.requests.append((url.path, params))
+                status, headers, body = respond(url.path, params)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body.encode())
+
+            def log_message(self, *args):
+                pass
+
+        self.__server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(
+            self.__server.server_address[1])
+        self.__thread = threading.Thread(target=self.__server.serve_forever,
+                                         daemon=True)
+
+    def __enter__(self):
+        self.__thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.__server.shutdown()
+        self.__server.server_close()
@@ -0,0 +1,123 @@
+from gdax_logger.Backfill import Backfill
+from stand_in import RestStandIn
+from datetime import datetime, timedelta
+import threading
+import tempfile
+import unittest
+import sqlite3
+import json
+import os
+
+
+BASE = datetime(2018, 1, 1)
+
+
+def trade_time(trade_id):
+    """Trades come in pairs that share a timestamp, ten seconds apart."""
+    return BASE + timedelta(seconds=trade_id // 2 * 10)
+
+
+class BackfillTest(unittest.TestCase):
+    """Backfills trades and candles from a local stand-in REST api that
+    pages trades with CB-AFTER and rate limits every fifth request."""
+
+    NEWEST_ID = 1000
+    PAGE_SIZE = 50
+    START = trade_time(200)
+    END = trade_time(600)
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.ticker_path = os.path.join(self.directory.name, 'tickers.db')
+        self.checkpoint_path = os.path.join(self.directory.name,
+                                            'backfill.json')
+        self.lock = threading.Lock()
+        self.received = 0
+        self.served = []
+        self.failing = set()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def respond(self, path, params):
+        with self.lock:
+            self.received += 1
+            if self.received % 5 == 0:
+                return 429, {'Retry-After': '0.01'}, ''
+            if params.get('after') in self.failing:
+                return 404, {}, json.dumps({'message': 'NotFound'})
+            self.served.append((path, params))
+
+        if path.endswith('/trades'):
+            return self.trades(params)
+        return self.candles(params)
+
+    def trades(self, params):
+        after = int(params.get('after', self.NEWEST_ID + 1))
+        limit = min(int(params['limit']), self.PAGE_SIZE)
+        ids = range(after - 1, max(after - 1 - limit, 0), -1)
+        page = [{'trade_id': trade_id, 'price': '100.00', 'size': '0.5',
+                 'side': 'buy' if trade_id % 2 else 'sell',
+                 'time': trade_time(trade_id).isoformat() + '.000Z'}
+                for trade_id in ids]
+        headers = {'CB-AFTER': str(ids[-1])} if page else {}
+        return 200, headers, json.dumps(page)
+
+    def candles(self, params):
+        start = datetime.strptime(params['start'], '%Y-%m-%dT%H:%M:%S')
+        end = datetime.strptime(params['end'], '%Y-%m-%dT%H:%M:%S')
+        granularity = int(params['granularity'])
+        candles = []
+        while start < end:
+            epoch = (start - datetime(1970, 1, 1)).total_seconds()
+            candles.insert(0, [epoch, 99.0, 101.0, 100.0, 100.5, 10.0])
+            start += timedelta(seconds=granularity)
+        return 200, {}, json.dumps(candles)
+
+    def backfill(self):
+        with RestStandIn(self.respond) as server:
+            with Backfill(rest_url=server.url, ticker_path=self.ticker_path,
+                          checkpoint_path=self.checkpoint_path, rate_limit=0,
+                          chunk_trades=100) as backfill:
+                return backfill.run(['BTC-USD'], self.START, self.END)
+
+    def query(self, sql):
+        with sqlite3.connect(self.ticker_path) as connection:
+            return connection.execute(sql).fetchall()
+
+    def test_trades_and_candles_are_backfilled(self):
+        counts = self.backfill()
+
+        # Trades 600 and 601 are exactly at the end, and left out.
+        self.assertEqual(counts, {'trades': 400, 'candles': 34})
+        self.assertEqual(self.query('SELECT COUNT(*) FROM tickers'),
+                         [(400,)])
+        self.assertEqual(self.query('SELECT MIN(server_time), '
+                                    'MAX(server_time) FROM tickers'),
+                         [(trade_time(200).isoformat() + '.000Z',
+                           trade_time(599).isoformat() + '.000Z')])
+        self.assertEqual(self.query('SELECT COUNT(*) FROM candles'),
+                         [(34,)])
+
+    def test_backfill_resumes_from_the_checkpoint(self):
+        # The second page of the chunk [300, 399] fails on the first run.
+        self.failing = {'350'}
+        counts = self.backfill()
+        self.assertEqual(counts, {'trades': 300, 'candles': 34})
+        self.assertEqual(self.query('SELECT COUNT(*) FROM tickers'),
+                         [(350,)])
+
+        self.failing = set()
+        self.served = []
+        counts = self.backfill()
+
+        # Only the newest trade and the failed page are fetched again.
+        self.assertEqual(counts, {'trades': 50, 'candles': 0})
+        self.assertEqual([params.get('after') for _, params in self.served],
+                         [None, '350'])
+        self.assertEqual(self.query('SELECT COUNT(*) FROM tickers'),
+                         [(400,)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+from gdax_logger.FeedMerger import FeedMerger
+from stand_in import StandInServer, lossy_script
+from websocket import WebSocketApp
+from time import sleep, time
+import threading
+import unittest
+import random
+import json
+
+
+def full_message(sequence):
+    return json.dumps({'type': 'received', 'product_id': 'BTC-USD',
+                       'sequence': sequence})
+
+
+def l2update(i, price='100.00'):
+    return json.dumps({'type': 'l2update', 'product_id': 'BTC-USD',
+                       'time': '2018-01-01T00:{:02d}:{:02d}.{:06d}Z'.format(
+                           i // 6000, i // 100 % 60, i % 100),
+                       'changes': [['buy', price, str(i)]]})
+
+
+def match(sequence):
+    return json.dumps({'type': 'match', 'product_id': 'BTC-USD',
+                       'sequence': sequence, 'trade_id': sequence,
+                       'price': '100.00'})
+
+
+class FeedMergerTest(unittest.TestCase):
+    """Merges connections to a local stand-in feed that drops and delays
+    messages."""
+
+    def setUp(self):
+        self.delivered = []
+        self.gaps = []
+        self.sockets = []
+
+    def tearDown(self):
+        for ws in self.sockets:
+            ws.close()
+
+    def connect(self, merger, url, connections):
+        for connection_id in range(connections):
+            def on_open(ws, connection_id=connection_id):
+                merger.connected(connection_id)
+                ws.send(json.dumps({'type': 'subscribe'}))
+
+            def on_message(ws, data, connection_id=connection_id):
+                merger.push(connection_id, data)
+
+            ws = WebSocketApp(url, on_open=on_open, on_message=on_message)
+            self.sockets.append(ws)
+            threading.Thread(target=ws.run_forever, daemon=True).start()
+            # Connections are accepted, and given scripts, in order.
+            sleep(0.1)
+
+    def wait_for(self, count, timeout=10):
+        deadline = time() + timeout
+        while len(self.delivered) < count and time() < deadline:
+            sleep(0.01)
+        sleep(0.1)
+
+    def test_lossy_connections_merge_without_gaps(self):
+        messages = [full_message(sequence) for sequence in range(1, 2001)]
+        rng = random.Random(1)
+        drops = [set(), set(), set()]
+        for i in range(len(messages)):
+            # Every message is dropped by at most two of the connections.
+            for connection_id in rng.sample(range(3), rng.randint(0, 2)):
+                drops[connection_id].add(i)
+        scripts = [lossy_script(messages, drop, 0.002, seed)
+                   for seed, drop in enumerate(drops)]
+
+        merger = FeedMerger(self.delivered.append,
+                            lambda *gap: self.gaps.append(gap),
+                            detect_gaps=True)
+        with StandInServer(scripts) as server:
+            self.connect(merger, server.url, 3)
+            self.wait_for(len(messages))
+        merger.close()
+
+        sequences = [json.loads(data)['sequence'] for data in self.delivered]
+        self.assertEqual(sequences, list(range(1, 2001)))
+        self.assertEqual(self.gaps, [])
+
+    def test_gap_is_resolved_when_the_product_goes_quiet(self):
+        messages = [full_message(sequence) for sequence in range(1, 16)]
+        missed = {10}
+        # The second connection stalls early, so it never moves past the
+        # gap and only the timer can resolve it.
+        scripts = [lossy_script(messages, missed),
+                   lossy_script(messages[:5])]
+
+        merger = FeedMerger(self.delivered.append,
+                            lambda *gap: self.gaps.append(gap),
+                            detect_gaps=True, max_delay=0.3)
+        with StandInServer(scripts) as server:
+            self.connect(merger, server.url, 2)
+            self.wait_for(14, timeout=3)
+        merger.close()
+
+        self.assertEqual(self.gaps, [('BTC-USD', 11, 11)])
+        self.assertEqual(len(self.delivered), 14)
+
+    def test_lagging_connection_never_replays_old_level2_updates(self):
+        messages = [l2update(i) for i in range(6000)]
+        scripts = [lossy_script(messages),
+                   [(0.5, messages[0])] + lossy_script(messages[1:])]
+
+        merger = FeedMerger(self.delivered.append)
+        with StandInServer(scripts) as server:
+            self.connect(merger, server.url, 2)
+            self.wait_for(len(messages))
+            sleep(1)
+        merger.close()
+
+        self.assertEqual(self.delivered, messages)
+
+    def test_lossy_leading_connection_is_backed_up(self):
+        messages = []
+        for i in range(1000):
+            messages.append(l2update(i, '{}.00'.format(100 + i)))
+            messages.append(match(i + 1))
+        rng = random.Random(2)
+        lost = set(rng.sample(range(len(messages)), 100))
+        # The first connection leads and loses messages, the second one
+        # catches every message a moment later.
+        scripts = [lossy_script(messages, lost),
+                   [(0.2, messages[0])] + lossy_script(messages[1:])]
+
+        merger = FeedMerger(self.delivered.append)
+        with StandInServer(scripts) as server:
+            self.connect(merger, server.url, 2)
+            self.wait_for(len(messages))
+            sleep(0.5)
+        merger.close()
+
+        stats = merger.get_stats()
+        self.assertEqual(sorted(self.delivered), sorted(messages))
+        self.assertEqual(stats['late'], len(lost))
+        self.assertEqual(stats['duplicates'], len(messages) - len(lost))
+
+    def test_late_level2_update_never_rolls_a_level_back(self):
+        merger = FeedMerger(self.delivered.append)
+        merger.push(0, l2update(2))
+        merger.push(1, l2update(1))
+        merger.push(1, l2update(2))
+        merger.close()
+
+        self.assertEqual(self.delivered, [l2update(2)])
+        self.assertEqual(merger.get_stats()['superseded'], 1)
+        self.assertEqual(merger.get_stats()['duplicates'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+from gdax_logger.L3OrderBook import L3OrderBook
+from collections import OrderedDict
+import unittest
+import random
+
+
+class BruteForceBook(object):
+    """A plain model of a level 3 book: the resting orders of every price
+    string, in time priority."""
+
+    def __init__(self):
+        self.levels = {}
+        self.orders = {}
+
+    def open(self, order_id, side, price, size):
+        self.orders[order_id] = (side, price)
+        self.levels.setdefault(price, OrderedDict())[order_id] = size
+
+    def done(self, order_id):
+        side, price = self.orders.pop(order_id)
+        del self.levels[price][order_id]
+
+    def resize(self, order_id, size):
+        side, price = self.orders[order_id]
+        self.levels[price][order_id] = size
+
+    def snapshot(self):
+        bids, asks = [], []
+        for price, level in self.levels.items():
+            for order_id, size in level.items():
+                side = self.orders[order_id][0]
+                orders = bids if side == 'buy' else asks
+                orders.append([price, str(size), order_id])
+        return {'bids': bids, 'asks': asks}
+
+
+class L3OrderBookTest(unittest.TestCase):
+    """Compares L3OrderBook with a brute force model on random messages,
+    over prices that truncate to the cent below in binary floating point,
+    such as 0.29 and 4.35."""
+
+    PRICES = ['0.28', '0.29', '0.57', '0.58', '1.13', '1.14', '4.34', '4.35',
+              '9.99', '0.01', '2.51', '8.19']
+
+    def apply_random_messages(self, book, model, rng, count, first_id=0):
+        for i in range(first_id, first_id + count):
+            if model.orders and rng.random() < 0.4:
+                order_id = rng.choice(sorted(model.orders))
+                side, price = model.orders[order_id]
+                if rng.random() < 0.5:
+                    model.done(order_id)
+                    book.apply_message({'type': 'done', 'order_id': order_id,
+                                        'side': side, 'price': price})
+                else:
+                    size = round(rng.uniform(0.01, 1), 4)
+                    model.resize(order_id, size)
+                    book.apply_message({'type': 'change',
+                                        'order_id': order_id,
+                                        'new_size': str(size),
+                                        'price': price, 'side': side})
+            else:
+                order_id = 'order-{}'.format(i)
+                price = rng.choice(self.PRICES)
+                side = 'buy' if float(price) < 5 else 'sell'
+                size = round(rng.uniform(0.01, 1), 4)
+                model.open(order_id, side, price, size)
+                book.apply_message({'type': 'open', 'order_id': order_id,
+                                    'side': side, 'price': price,
+                                    'remaining_size': str(size)})
+
+    def assert_matches(self, book, model):
+        for price in self.PRICES:
+            level = model.levels.get(price, OrderedDict())
+            self.assertEqual([order.order_id
+                              for order in book.get_level(price)],
+                             list(level), price)
+            self.assertAlmostEqual(book.get_volume_in_range(price, price),
+                                   sum(level.values()), msg=price)
+            self.assertEqual(book.get_order_count_in_range(price, price),
+                             len(level), price)
+            for position, order_id in enumerate(level):
+                orders_ahead, size_ahead = book.queue_position(order_id)
+                self.assertEqual(orders_ahead, position)
+                self.assertAlmostEqual(
+                    size_ahead, sum(list(level.values())[:position]))
+        self.assertAlmostEqual(book.get_total_volume(),
+                               sum(sum(level.values())
+                                   for level in model.levels.values()))
+
+    def test_messages_match_brute_force(self):
+        rng = random.Random(0)
+        book = L3OrderBook(10, 'BTC-USD')
+        model = BruteForceBook()
+        book.init_book(model.snapshot())
+        self.apply_random_messages(book, model, rng, 3000)
+        self.assert_matches(book, model)
+
+    def test_resync_matches_brute_force(self):
+        rng = random.Random(1)
+        book = L3OrderBook(10, 'BTC-USD')
+        book.init_book(BruteForceBook().snapshot())
+        self.apply_random_messages(book, BruteForceBook(), rng, 1000)
+
+        model = BruteForceBook()
+        self.apply_random_messages(L3OrderBook(10, 'BTC-USD'), model, rng,
+                                   1000, first_id=1000)
+        book.resync_book(book.prepare_snapshot(model.snapshot()))
+        self.assert_matches(book, model)
+
+        self.apply_random_messages(book, model, rng, 1000, first_id=2000)
+        self.assert_matches(book, model)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+from gdax_logger.LoggerHandler import LoggerHandler
+from stand_in import RestStandIn
+from time import sleep, time
+import threading
+import tempfile
+import unittest
+import json
+import os
+
+
+def open_order(sequence, price='100.00', size='1.0'):
+    return json.dumps({'type': 'open', 'product_id': 'BTC-USD',
+                       'sequence': sequence, 'side': 'buy', 'price': price,
+                       'order_id': 'order-{}'.format(sequence),
+                       'remaining_size': size})
+
+
+def snapshot(sequence):
+    """A level 3 snapshot holding one order of every sequence up to
+    `sequence`, as if every open_order() up to it had been applied."""
+    return json.dumps({'sequence': sequence, 'asks': [],
+                       'bids': [['100.00', '1.0', 'order-{}'.format(i)]
+                                for i in range(1, sequence + 1)]})
+
+
+class ResyncTest(unittest.TestCase):
+    """Resyncs a level 3 book from a local stand-in REST api while its
+    updates are buffered."""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        self.release = threading.Event()
+        self.responses = []
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def respond(self, path, params):
+        self.release.wait(5)
+        return self.responses.pop(0)
+
+    def resync(self, responses, first, last):
+        """Buffer the open orders [first, last] while the snapshot is
+        held back, then serve `responses` one request at a time, and
+        return the book and the number of requests made."""
+        self.responses = list(responses)
+        with RestStandIn(self.respond) as server:
+            with LoggerHandler(rest_url=server.url,
+                               full_products=['BTC-USD']) as handler:
+                book = handler._order_books['BTC-USD']
+                for sequence in range(first, last + 1):
+                    handler.update_order_book(open_order(sequence))
+                self.release.set()
+                deadline = time() + 10
+                while book.is_stale() and time() < deadline:
+                    sleep(0.05)
+                return book, len(server.requests)
+
+    def test_snapshot_older_than_the_buffer_is_refetched(self):
+        book, requests = self.resync([(200, {}, snapshot(5)),
+                                      (200, {}, snapshot(12))], 10, 15)
+
+        self.assertFalse(book.is_stale())
+        self.assertEqual(requests, 2)
+        self.assertEqual(book.get_order_count_in_range(100, 100), 15)
+        self.assertEqual(book.get_volume_in_range(100, 100), 15.0)
+
+    def test_failed_resync_is_retried(self):
+        book, requests = self.resync([(200, {}, 'not json'),
+                                      (200, {}, json.dumps({})),
+                                      (200, {}, snapshot(11))], 10, 12)
+
+        self.assertFalse(book.is_stale())
+        self.assertEqual(requests, 3)
+        self.assertEqual(book.get_order_count_in_range(100, 100), 12)
+
+    def test_resync_waits_for_the_first_full_message(self):
+        self.responses = [(200, {}, snapshot(10))]
+        self.release.set()
+        with RestStandIn(self.respond) as server:
+            with LoggerHandler(rest_url=server.url,
+                               full_products=['BTC-USD']) as handler:
+                book = handler._order_books['BTC-USD']
+                sleep(0.5)
+                self.assertEqual(server.requests, [])
+
+                handler.update_order_book(open_order(10))
+                handler.update_order_book(open_order(11))
+                deadline = time() + 10
+                while not book.built() and time() < deadline:
+                    sleep(0.05)
+
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual(book.get_order_count_in_range(100, 100), 11)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+from gdax_logger.L3OrderBook import L3OrderBook
+from gdax_logger.MultiBook import MultiBook
+from gdax_logger.OrderBook import OrderBook
+import unittest
+import random
+
+
+class MultiBookTest(unittest.TestCase):
+    """Compares the vectorized rows of MultiBook.query() with
+    OrderBook.query() on standalone copies of the same books."""
+
+    PERCENT_RANGES = [0.5, 1.0, 5.0, 20.0, 60.0, 100.0]
+    PRICE_CAPS = {'BTC-USD': 200, 'ETH-USD': 50.5, 'LTC-USD': 10.01}
+    BOOK_TYPES = {'ETH-USD': L3OrderBook}
+
+    def random_orders(self, rng, price_cap, count):
+        orders = {'bids': [], 'asks': []}
+        market_price = round(rng.uniform(0.01, price_cap * 0.9), 2)
+        for i in range(count):
+            price = round(rng.uniform(0.01, price_cap - 0.01), 2)
+            size = str(round(rng.uniform(0.01, 5), 4))
+            side = 'bids' if price <= market_price else 'asks'
+            orders[side].append(['{:.2f}'.format(price), size,
+                                 'order-{}'.format(i)])
+        return orders, market_price
+
+    def assert_rows_match(self, multi_book, books):
+        rows, _ = multi_book.query(self.PERCENT_RANGES)
+        self.assertEqual([row[1] for row in rows], list(books))
+        for row in rows:
+            expected = books[row[1]].query(self.PERCENT_RANGES)
+            self.assertEqual(len(row), len(expected))
+            self.assertEqual(row[3], expected[3])
+            for volume, expected_volume in zip(row[4:], expected[4:]):
+                self.assertAlmostEqual(volume, expected_volume)
+
+    def test_query_matches_order_book(self):
+        rng = random.Random(0)
+        multi_book = MultiBook(self.PRICE_CAPS, self.BOOK_TYPES)
+        books = {}
+        for product_id, price_cap in self.PRICE_CAPS.items():
+            book_type = self.BOOK_TYPES.get(product_id, OrderBook)
+            books[product_id] = book_type(price_cap, product_id)
+            orders, market_price = self.random_orders(rng, price_cap, 500)
+            for book in (books[product_id], multi_book.books[product_id]):
+                book.init_book(orders)
+                book.update_market_price(market_price)
+        self.assert_rows_match(multi_book, books)
+
+        for _ in range(200):
+            product_id = rng.choice(sorted(self.PRICE_CAPS))
+            price_cap = self.PRICE_CAPS[product_id]
+            if product_id in self.BOOK_TYPES:
+                continue
+            price = round(rng.uniform(0.01, price_cap - 0.01), 2)
+            volume = round(rng.uniform(0, 5), 4)
+            market_price = round(rng.uniform(0.01, price_cap - 0.01), 2)
+            for book in (books[product_id], multi_book.books[product_id]):
+                book.update_volume(price, volume)
+                book.update_market_price(market_price)
+        self.assert_rows_match(multi_book, books)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+from gdax_logger.RingBuffer import RingBuffer, RingReader
+import tempfile
+import unittest
+import os
+
+
+class LappedReader(RingReader):
+    """A reader whose writer appends `records` more records while it is
+    copying, i.e. just before the cursor is read the second time."""
+
+    def __init__(self, path, append, records):
+        super().__init__(path)
+        self.append = append
+        self.records = records
+        self.reads = 0
+
+    def cursor(self):
+        self.reads += 1
+        if self.reads == 2:
+            self.append(self.records)
+        return super().cursor()
+
+
+class RingBufferTest(unittest.TestCase):
+    """Writes records to a ring file and reads them back with RingReader.
+    Each record holds its index and its negation."""
+
+    CAPACITY = 8
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'BTC-USD.ring')
+        self.ring = RingBuffer(self.path, ['index', 'negated'],
+                               self.CAPACITY)
+        self.ring.written = 0
+
+    def tearDown(self):
+        self.ring.close()
+        self.directory.cleanup()
+
+    def append(self, count):
+        for _ in range(count):
+            self.ring.append([self.ring.written, -self.ring.written])
+            self.ring.written += 1
+
+    def assert_latest(self, records, first, last):
+        self.assertEqual(records['index'].tolist(),
+                         list(range(first, last + 1)))
+        self.assertEqual(records['negated'].tolist(),
+                         [-index for index in range(first, last + 1)])
+
+    def test_latest_wraps_around(self):
+        reader = RingReader(self.path)
+        try:
+            self.assertEqual(len(reader.latest()), 0)
+            self.append(5)
+            self.assert_latest(reader.latest(), 0, 4)
+            self.append(20)
+            self.assertEqual(reader.cursor(), 25)
+            self.assert_latest(reader.latest(), 18, 24)
+            self.assert_latest(reader.latest(3), 22, 24)
+        finally:
+            reader.close()
+
+    def test_latest_drops_records_overwritten_while_copying(self):
+        self.append(20)
+        for records in (0, 1, 3, 6, 7, 9):
+            reader = LappedReader(self.path, self.append, records)
+            try:
+                cursor = self.ring.written
+                # Of the records [cursor - 7, cursor) being copied, those
+                # rewritten by the writer, or next in line, are dropped.
+                first = cursor - self.CAPACITY + 1 + records
+                self.assert_latest(reader.latest(), first, cursor - 1)
+            finally:
+                reader.close()
+
+
+if __name__ == '__main__':
+    unittest.main()